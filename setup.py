@@ -18,7 +18,8 @@ CLASSIFIERS = [
     'Programming Language :: Python :: Implementation :: CPython',
     'Topic :: Scientific/Engineering :: Bio-Informatics',
 ]
-INSTALL_REQUIRES = ['numpy', 'lxml', 'biopython']
+INSTALL_REQUIRES = ['numpy', 'lxml']
+EXTRAS_REQUIRE = {'test': ['biopython']}
 METADATA = {
     'version': '3.6',
     'title': 'msstitch',
@@ -57,5 +58,6 @@ if __name__ == '__main__':
         long_description_content_type='text/markdown',
         classifiers=CLASSIFIERS,
         install_requires=INSTALL_REQUIRES,
+        extras_require=EXTRAS_REQUIRE,
         entry_points=CLI,
     )
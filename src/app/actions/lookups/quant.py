@@ -1,73 +1,162 @@
+import os
+from collections import deque
 from decimal import Decimal
+from functools import partial
+from itertools import repeat
+from multiprocessing import Pool
+
+import numpy as np
 
 from app.readers import openms as openmsreader
+from app.readers import tsv as tsvreader
 DB_STORE_CHUNK = 500000
+# Max retention time difference (minutes) between consensusXML and mzML
+# spectra that are the same scan, absorbs rounding drift between formats
+ISOBARIC_RT_TOLERANCE = 0.00001
 FEATURE_ALIGN_WINDOW_AMOUNT = 1000
 PROTON_MASS = 1.0072
 
 
-def create_isobaric_quant_lookup(quantdb, specfn_consensus_els, channelmap):
+def create_isobaric_quant_lookup(quantdb, mzmlfns, consfns, channelmap,
+        processes=1):
     """Creates an sqlite lookup table of scannrs with quant data.
 
-    spectra - an iterable of tupled (filename, spectra)
-    consensus_els - a iterable with consensusElements"""
+    mzmlfns - spectra filenames, matching order with
+    consfns - consensusXML filenames, parsed in a worker pool when
+    processes > 1"""
     # store quantchannels in lookup and generate a db_id vs channel map
     channels_store = ((name,) for name, c_id
                       in sorted(channelmap.items(), key=lambda x: int(x[1])))
     quantdb.store_channelmap(channels_store)
     channelmap_dbid = {channelmap[ch_name]: ch_id for ch_id, ch_name in
                        quantdb.get_channelmap()}
-    quants = []
+    channels = sorted(channelmap.values(), key=int)
+    channel_dbids = np.array([channelmap_dbid[ch] for ch in channels])
     mzmlmap = quantdb.get_mzmlfile_map()
-    active_fn = None
-    for specfn, consensus_el in specfn_consensus_els:
-        if specfn != active_fn:
-            active_fn = specfn
-            specmap = quantdb.get_specmap(mzmlmap[specfn], retention_time=True)
-        rt = openmsreader.get_consxml_rt(consensus_el)
-        rt = round(float(Decimal(rt) / 60), 12)
-        qdata = get_quant_data(consensus_el)
-        spectra_id = specmap[rt]
-        for channel_no in sorted(qdata.keys()):
-            quants.append((spectra_id, channelmap_dbid[channel_no],
-                           qdata[channel_no]))
-            if len(quants) == DB_STORE_CHUNK:
-                quantdb.store_isobaric_quants(quants)
-                quants = []
-    quantdb.store_isobaric_quants(quants)
+    consparser = partial(openmsreader.get_consensus_quants, channels=channels)
+    if processes > 1:
+        with Pool(processes) as pool:
+            store_isobaric_quants(quantdb, mzmlmap, mzmlfns,
+                                  pool.imap(consparser, consfns), channel_dbids)
+    else:
+        store_isobaric_quants(quantdb, mzmlmap, mzmlfns, map(consparser, consfns),
+                              channel_dbids)
     quantdb.index_isobaric_quants()
 
 
-def create_precursor_quant_lookup(quantdb, mzmlfn_feats, sum_or_apex, quanttype,
-        rttol, mztol, mztoltype):
-    """Fills quant sqlite with precursor quant from:
-        features - generator of xml features from openms
+def store_isobaric_quants(quantdb, mzmlmap, mzmlfns, fn_rts_quants, channel_dbids):
+    """Matches consensus element retention times (seconds) of each file to
+    its spectra and stores the reporter intensities"""
+    for mzmlfn, (rts, intensities) in zip(mzmlfns, fn_rts_quants):
+        if not len(rts):
+            continue
+        rt_index = get_spectra_rt_index(quantdb, mzmlmap[os.path.basename(mzmlfn)])
+        spectra_ids = match_rt_index(rt_index, rts / 60)
+        els, chans = np.nonzero(~np.isnan(intensities))
+        quants = list(zip(spectra_ids[els].tolist(), channel_dbids[chans].tolist(),
+                          intensities[els, chans].tolist()))
+        for i in range(0, len(quants), DB_STORE_CHUNK):
+            quantdb.store_isobaric_quants(quants[i:i + DB_STORE_CHUNK])
+
+
+def get_spectra_rt_index(quantdb, fn_id):
+    """Returns RT sorted arrays of retention times and spectra ids for
+    the spectra of an mzML file"""
+    rt_spectra = quantdb.get_fnspectra_rt_sorted(fn_id)
+    return (np.array([x[0] for x in rt_spectra], dtype=float),
+            np.array([x[1] for x in rt_spectra], dtype=object))
+
+
+def match_rt_index(rt_index, rts, tolerance=ISOBARIC_RT_TOLERANCE):
+    """Returns spectra ids of the spectra nearest in retention time to
+    each of the passed retention times (minutes). Raises an error if there
+    is no spectrum within tolerance"""
+    index_rts, spectra_ids = rt_index
+    if not len(index_rts):
+        raise RuntimeError('No spectra in lookup for the mzML file of this '
+                           'quant data')
+    right = np.searchsorted(index_rts, rts).clip(0, len(index_rts) - 1)
+    left = (right - 1).clip(0)
+    nearest = np.where(np.abs(index_rts[left] - rts) < np.abs(index_rts[right] - rts),
+                       left, right)
+    unmatched = np.abs(index_rts[nearest] - rts) > tolerance
+    if unmatched.any():
+        raise RuntimeError('Could not find a spectrum in the lookup for '
+                           'quant data with retention time {} '
+                           'minutes'.format(rts[unmatched][0]))
+    return spectra_ids[nearest]
+
+
+def create_precursor_quant_lookup(quantdb, mzmlfns, ms1fns, sum_or_apex, quanttype,
+        rttol, mztol, mztoltype, processes=1):
+    """Fills quant sqlite with precursor quant from dinosaur/kronik output.
+    Each MS1 feature file is parsed and aligned to the spectra of its mzML
+    in a worker, results are stored by this (single writer) process in
+    input file order.
     """
-    featparsermap = {'kronik': kronik_featparser,
-                     'openms': openms_featparser,
-                     'dinosaur': dinosaur_featparser,
-                     }
-    features, fwhms = [], []
     mzmlmap = quantdb.get_mzmlfile_map()
-    for specfn, feat_element in mzmlfn_feats:
-        feat = featparsermap[quanttype](feat_element, sum_or_apex)
-        features.append((mzmlmap[specfn], feat['rt'], feat['mz'],
-                         feat['charge'], feat['intensity'])
-                        )
-        fwhms.append(feat['fwhm'])
-        if len(features) == DB_STORE_CHUNK:
-            id_feats = quantdb.store_ms1_quants(features)
-            if quanttype == 'dinosaur':
-                quantdb.store_fwhm(zip([x[0] for x in id_feats], fwhms))
-            features, fwhms = [], []
-    id_feats = quantdb.store_ms1_quants(features)
-    if quanttype == 'dinosaur':
-        quantdb.store_fwhm(zip([x[0] for x in id_feats], fwhms))
+    fn_ids = [mzmlmap[os.path.basename(fn)] for fn in mzmlfns]
+
+    def get_job(fn_id, ms1fn):
+        return (ms1fn, quantdb.get_fnspectra_mz_sorted(fn_id), quanttype,
+                sum_or_apex, rttol, mztol, mztoltype)
+
+    if processes > 1:
+        # Submit from this thread since the lookup cannot be shared with the
+        # pool's threads, and keep at most one job per process pending
+        with Pool(processes) as pool:
+            pending = deque()
+            for fn_id, ms1fn in zip(fn_ids, ms1fns):
+                if len(pending) == processes:
+                    done_fn_id, result = pending.popleft()
+                    store_precursor_quants(quantdb, done_fn_id, *result.get(), quanttype)
+                pending.append((fn_id, pool.apply_async(parse_align_ms1_file,
+                                                        (get_job(fn_id, ms1fn),))))
+            for fn_id, result in pending:
+                store_precursor_quants(quantdb, fn_id, *result.get(), quanttype)
+    else:
+        for fn_id, ms1fn in zip(fn_ids, ms1fns):
+            store_precursor_quants(quantdb, fn_id,
+                    *parse_align_ms1_file(get_job(fn_id, ms1fn)), quanttype)
     quantdb.index_precursor_quants()
-    align_quants_psms(quantdb, rttol, mztol, mztoltype)
     quantdb.index_aligned_quants()
 
 
+def store_precursor_quants(quantdb, fn_id, feats, aligns, quanttype):
+    """Stores feature arrays of a file and their spectra alignments. Feature
+    IDs are assigned here so aligned features, which carry their index in
+    the file's feature arrays, can be stored without querying back"""
+    first_feat_id = quantdb.get_highest_feature_id() + 1
+    columns = [feats[x].tolist() for x in ['rt', 'mz', 'charge', 'intensity']]
+    if quanttype == 'dinosaur':
+        columns.append(feats['fwhm'].tolist())
+    for i in range(0, len(columns[0]), DB_STORE_CHUNK):
+        chunk = [col[i:i + DB_STORE_CHUNK] for col in columns]
+        feat_ids = range(first_feat_id + i, first_feat_id + i + len(chunk[0]))
+        quantdb.store_ms1_quants(zip(feat_ids, repeat(fn_id), *chunk[:4]))
+        if quanttype == 'dinosaur':
+            quantdb.store_fwhm(zip(feat_ids, chunk[4]))
+    for i in range(0, len(aligns), DB_STORE_CHUNK):
+        quantdb.store_ms1_alignments([(spec_id, first_feat_id + feat_ix) for spec_id, feat_ix
+                                      in aligns[i:i + DB_STORE_CHUNK]])
+
+
+def parse_align_ms1_file(job):
+    """Worker function, parses features from an MS1 feature file and aligns
+    them to the passed spectra of the corresponding mzML file. Returns the
+    feature arrays and (spectra_id, feature index) alignments"""
+    ms1fn, spectra, quanttype, sum_or_apex, rttol, mztol, mztoltype = job
+    featparsermap = {'kronik': kronik_featparser,
+                     'dinosaur': dinosaur_featparser,
+                     }
+    feats = featparsermap[quanttype](ms1fn, sum_or_apex)
+    mzorder = np.argsort(feats['mz'], kind='stable')
+    mzsorted_feats = zip(feats['mz'][mzorder].tolist(), mzorder.tolist(),
+                         feats['charge'][mzorder].tolist(),
+                         feats['rt'][mzorder].tolist())
+    return feats, align_quants_psms(spectra, mzsorted_feats, rttol, mztol, mztoltype)
+
+
 def get_minmax(center, tolerance, toltype=None):
     center = float(center)
     if toltype == 'ppm':
@@ -77,28 +166,22 @@ def get_minmax(center, tolerance, toltype=None):
     return center - tolerance, center + tolerance
 
 
-def align_quants_psms(quantdb, rt_tolerance, mz_tolerance, mz_toltype):
-    allspectra = quantdb.get_spectra_mz_sorted()
+def align_quants_psms(spectra, fnfeats, rt_tolerance, mz_tolerance, mz_toltype):
+    """Aligns mz-sorted spectra of a single file to the mz-sorted features
+    of that file, returns list of (spectra_id, feature id) for alignments"""
+    fnfeats = iter(fnfeats)
     featwindow_max_mz = -1
     spec_feat_store = []
-    active_fn = None
-    for spec_id, fn_id, charge, mz, rt in allspectra:
-        if fn_id != active_fn:
-            active_fn = fn_id
-            featwindow_max_mz = -1
-            fnfeats = quantdb.get_fnfeats(fn_id)
+    for spec_id, charge, mz, rt in spectra:
         minmz, maxmz = get_minmax(mz, mz_tolerance, mz_toltype)
         if maxmz > featwindow_max_mz:
             feat_map, featwindow_max_mz = get_precursors_from_window(fnfeats,
                                                                      minmz)
         best_feat_id = align_psm(mz, rt, charge, feat_map, rt_tolerance)
-        if not best_feat_id:
+        if best_feat_id is False:
             continue
         spec_feat_store.append((spec_id, best_feat_id))
-        if len(spec_feat_store) > DB_STORE_CHUNK:
-            quantdb.store_ms1_alignments(spec_feat_store)
-            spec_feat_store = []
-    quantdb.store_ms1_alignments(spec_feat_store)
+    return spec_feat_store
 
 
 def align_psm(psm_mz, psm_rt, charge, featmap, rttol):
@@ -137,27 +220,35 @@ def get_precursors_from_window(mzfeatmap, minmz):
     return chargemap, mz
 
 
-def kronik_featparser(feature, sum_or_apex):
-    charge = int(feature['Charge'])
-    mz = (float(feature['Monoisotopic Mass']) + charge * PROTON_MASS) / charge
+def round_rts(rts):
+    # Python round, not np.round, which differs in the last digit at times
+    return np.array([round(rt, 12) for rt in rts.tolist()])
+
+
+def kronik_featparser(ms1fn, sum_or_apex):
+    """Returns features from a Kronik output file as a dict of arrays"""
     intkey = {'sum': 'Summed Intensity', 'apex': 'Best Intensity'}[sum_or_apex]
-    return {'rt': round(float(feature['Best RTime']), 12),
-            'mz': mz,
+    feats = tsvreader.get_tsv_column_arrays(ms1fn, ['Charge', 'Monoisotopic Mass',
+                                                    'Best RTime', intkey])
+    charge = feats['Charge'].astype(int)
+    return {'rt': round_rts(feats['Best RTime']),
+            'mz': (feats['Monoisotopic Mass'] + charge * PROTON_MASS) / charge,
             'charge': charge,
-            'intensity': float(feature[intkey]),
+            'intensity': feats[intkey],
             'fwhm': False,
             }
 
 
-def dinosaur_featparser(feature, sum_or_apex):
-    # FIXME is kronik, change, add FWHM
-    #mz = (float(feature['mz']) + charge * PROTON_MASS) / charge
+def dinosaur_featparser(ms1fn, sum_or_apex):
+    """Returns features from a Dinosaur output file as a dict of arrays"""
     intkey = {'sum': 'intensitySum', 'apex': 'intensityApex'}[sum_or_apex]
-    return {'rt': round(float(feature['rtApex']), 12),
-            'mz': float(feature['mz']),
-            'charge': int(feature['charge']),
-            'intensity': float(feature[intkey]),
-            'fwhm': float(feature['fwhm']),
+    feats = tsvreader.get_tsv_column_arrays(ms1fn, ['mz', 'charge', 'rtApex',
+                                                    'fwhm', intkey])
+    return {'rt': round_rts(feats['rtApex']),
+            'mz': feats['mz'],
+            'charge': feats['charge'].astype(int),
+            'intensity': feats[intkey],
+            'fwhm': feats['fwhm'],
             }
 
 
@@ -165,11 +256,3 @@ def openms_featparser(feature):
     feat = openmsreader.get_feature_info(feature)
     feat['rt'] = round(float(Decimal(feat['rt']) / 60), 12)
     return feat
-
-
-def get_quant_data(cons_el):
-    """Gets quant data from consensusXML element"""
-    quant_out = {}
-    for reporter in cons_el.findall('.//element'):
-        quant_out[reporter.attrib['map']] = reporter.attrib['it']
-    return quant_out
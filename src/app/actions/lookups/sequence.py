@@ -1,50 +1,161 @@
-from Bio import SeqIO
+from functools import partial
+from itertools import chain, islice
+from multiprocessing import Pool
 
-from app.actions.sequence import trypsinize
+import numpy as np
 
-PROTEIN_STORE_CHUNK_SIZE = 100000
+from app.actions.sequence import trypsinize, DIGEST_CHUNK
+from app.readers import fasta as fastareader
 
+# Separates proteins in the proteome sequence so peptides do not match
+# across proteins, sorts before amino acids
+PROTEOME_SEPARATOR = '$'
+PROTEOME_CHUNK_SIZE = 10000000
+# Amount of characters to initially sort suffixes on, packed in 64 bits
+PACKED_PREFIX = 8
 
-def create_searchspace_wholeproteins(lookup, fastafn, minpeplen):
-    fasta = SeqIO.parse(fastafn, 'fasta')
-    prots = {str(prot.seq).replace('L', 'I'): prot.id for prot in fasta}
-    storeseqs = []
-    peptotal = 0
-    for protseq, prot_id in prots.items():
-        for pos in range(0, len(protseq) - minpeplen + 1):
-            possible_pep = protseq[pos:pos + minpeplen]
-            peptotal += 1
-            storeseqs.append((possible_pep, prot_id, pos))
-        if len(storeseqs) > PROTEIN_STORE_CHUNK_SIZE:
-            lookup.store_pep_proteins(storeseqs)
-            storeseqs = []
-    lookup.store_pep_proteins(storeseqs)
-    lookup.index_proteins()
-    print('Stored {} peptides from {} proteins (reduced FASTA to remove '
-          'duplicate sequences)'.format(peptotal, len(prots)))
+
+def create_searchspace_wholeproteins(lookup, fastafn):
+    """Stores the proteins of a FASTA file (leucines exchanged for isoleucines
+    and duplicate sequences removed) concatenated to a single proteome
+    sequence, separated by PROTEOME_SEPARATOR, and its suffix array, so any
+    peptide can be matched to proteins and positions"""
+    prots = {seq.replace('L', 'I'): acc for acc, header, seq in
+             fastareader.generate_fasta_records(fastafn)}
+    starts = np.cumsum([0] + [len(protseq) + 1 for protseq in prots])[:-1]
+    proteome = '{}{}'.format(PROTEOME_SEPARATOR.join(prots),
+                             PROTEOME_SEPARATOR).encode('ascii')
+    suffixes = create_suffix_array(proteome)
+    suffixes = suffixes.astype(np.uint32 if len(proteome) < 2**32 else np.int64)
+    chunks = ((ix, proteome[pos:pos + PROTEOME_CHUNK_SIZE],
+               suffixes[pos:pos + PROTEOME_CHUNK_SIZE].tobytes())
+              for ix, pos in enumerate(range(0, len(proteome), PROTEOME_CHUNK_SIZE)))
+    lookup.store_proteome(zip(prots.values(), starts.tolist()), chunks)
+    print('Stored {} amino acids from {} proteins (reduced FASTA to remove '
+          'duplicate sequences)'.format(len(proteome) - len(prots), len(prots)))
+
+
+def create_suffix_array(text):
+    """Returns the suffix array of a bytes text, sorting suffixes by
+    prefix doubling. Suffixes are first sorted by their packed first
+    PACKED_PREFIX characters, after which only suffixes in groups with an
+    identical prefix are sorted further, by the rank of the suffix the
+    prefix length further, until all ranks are unique. The rank of a suffix
+    is the suffix array position where its group starts"""
+    size = len(text)
+    if not size:
+        return np.zeros(0, dtype=np.int64)
+    # A suffix that is past the end ranks lowest, since text has no 0 bytes
+    chars = np.zeros(size + PACKED_PREFIX, dtype=np.uint64)
+    chars[:size] = np.frombuffer(text, dtype=np.uint8)
+    keys = np.zeros(size, dtype=np.uint64)
+    for offset in range(PACKED_PREFIX):
+        keys = (keys << np.uint64(8)) | chars[offset:offset + size]
+    del chars
+    suffixes = np.argsort(keys)
+    keys = keys[suffixes]
+    rank = np.empty(size, dtype=np.int64)
+    rank[suffixes], unsorted = get_group_ranks(keys[1:] != keys[:-1],
+                                               np.arange(size))
+    del keys
+    step = PACKED_PREFIX
+    # Sorting a single key is much faster than lexsort, if it fits
+    combine_keys = (size + 1) ** 2 < 2 ** 63
+    while len(unsorted):
+        positions = suffixes[unsorted]
+        grouprank = rank[positions]
+        nextrank = np.full(len(positions), -1, dtype=np.int64)
+        inside = positions < size - step
+        nextrank[inside] = rank[positions[inside] + step]
+        if combine_keys:
+            order = np.argsort(grouprank * (size + 1) + nextrank)
+        else:
+            order = np.lexsort((nextrank, grouprank))
+        positions, grouprank, nextrank = (positions[order], grouprank[order],
+                                          nextrank[order])
+        suffixes[unsorted] = positions
+        rank[positions], unsorted = get_group_ranks(
+            (grouprank[1:] != grouprank[:-1]) | (nextrank[1:] != nextrank[:-1]),
+            unsorted)
+        step *= 2
+    return suffixes
+
+
+def get_group_ranks(changes, sa_positions):
+    """Given sorted suffixes at sa_positions and where their sort keys change,
+    returns their ranks and the positions of suffixes that share their rank"""
+    starts = np.concatenate(([True], changes))
+    groups = np.cumsum(starts) - 1
+    ranks = sa_positions[starts][groups]
+    return ranks, sa_positions[np.bincount(groups)[groups] > 1]
 
 
 def create_searchspace(lookup, infile, minlen, proline_cut=False, reverse_seqs=True,
-        do_trypsinize=True, miss_cleavage=False):
+        do_trypsinize=True, miss_cleavage=False, processes=1):
     """Given a FASTA database, proteins are trypsinized and resulting peptides
-    stored in a database or dict for lookups"""
-    allpeps = []
-    def treat_pep(seq, do_trypsinize, proline_cut, miss_cleavage, minlen): 
+    stored in a database or dict for lookups. With processes > 1 chunks of
+    proteins are digested in parallel, peptides are stored in input order"""
+    digest = partial(digest_proteins, do_trypsinize=do_trypsinize,
+                     proline_cut=proline_cut, miss_cleavage=miss_cleavage,
+                     minlen=minlen)
+    chunks = generate_chunks(generate_searchspace_seqs(infile), DIGEST_CHUNK)
+    if processes > 1:
+        with Pool(processes) as pool:
+            lookup.write_peps(chain.from_iterable(pool.imap(digest, chunks)),
+                              reverse_seqs)
+    else:
+        lookup.write_peps(chain.from_iterable(map(digest, chunks)),
+                          reverse_seqs)
+    lookup.index_peps(reverse_seqs)
+
+
+def create_searchspace_set(infile, minlen, miss_cleavage=False):
+    """Returns the tryptic peptides of a FASTA database as an in-memory set,
+    to check decoys against the target search space without a lookup"""
+    chunks = generate_chunks(generate_searchspace_seqs(infile), DIGEST_CHUNK)
+    return {pep for chunk in chunks for pep, in digest_proteins(
+        chunk, True, False, miss_cleavage, minlen)}
+
+
+def get_searchspace_set(lookup):
+    """Returns the sequences of a search space lookup as an in-memory set"""
+    return {seq for seq, in lookup.get_all_seqs()}
+
+
+def generate_searchspace_seqs(infile):
+    """Yields protein sequences from a FASTA file, or from a text file with a
+    sequence per line"""
+    with open(infile) as fp:
+        ftype = 'fasta' if fp.read(1) == '>' else 'txt'
+        fp.seek(0)
+        if ftype == 'txt':
+            yield from (x.strip('\n') for x in fp)
+    if ftype == 'fasta':
+        yield from (seq for acc, header, seq in
+                    fastareader.generate_fasta_records(infile))
+
+
+def digest_proteins(seqs, do_trypsinize, proline_cut, miss_cleavage, minlen):
+    """Returns the peptides of a chunk of protein sequences, without
+    duplicates and in order of first occurrence, as tuples for storing.
+    Removing duplicates per chunk means less data to pass from workers"""
+    peps = {}
+    for seq in seqs:
         if do_trypsinize:
             pepseqs = trypsinize(seq, proline_cut, miss_cleavage=miss_cleavage)
         else:
             pepseqs = [seq]
-        # Exchange all leucines to isoleucines because MS can't differ
-        pepseqs = [(pep.replace('L', 'I'),) for pep in pepseqs]
-        if minlen:
-            pepseqs = [pep for pep in pepseqs if len(pep[0]) >= minlen]
-        return pepseqs
-    with open(infile) as fp:
-        ftype = 'fasta' if fp.read(1) == '>' else 'txt'
-        fp.seek(0)
-        if ftype == 'fasta':
-            records = (str(x.seq) for x in SeqIO.parse(fp, 'fasta'))
-        elif ftype == 'txt':
-            records = (x.strip('\n') for x in fp)
-        lookup.write_peps((pep for x in records for pep in treat_pep(x, do_trypsinize, proline_cut, miss_cleavage, minlen)), reverse_seqs)
-    lookup.index_peps(reverse_seqs)
+        for pep in pepseqs:
+            if not minlen or len(pep) >= minlen:
+                # Exchange all leucines to isoleucines because MS can't differ
+                peps[pep.replace('L', 'I')] = True
+    return [(pep,) for pep in peps]
+
+
+def generate_chunks(items, size):
+    """Yields lists of size items"""
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
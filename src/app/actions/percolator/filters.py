@@ -1,19 +1,123 @@
 import re
 from itertools import product
 
+import numpy as np
+
 from app.readers import percolator as reader
 from app.readers import fasta
 from app.readers import xmlformatting as formatting
+from app.actions.lookups.sequence import PROTEOME_SEPARATOR
+
+SEPARATOR = ord(PROTEOME_SEPARATOR)
+TRYPTIC_RESIDUES = b'KR'
+DEAMIDATES, DEAMIDATED = ord('D'), ord('N')
+
+
+def get_proteome_index(lookup):
+    """Returns the proteome sequence and its suffix array from a lookup"""
+    sequences, suffixes = zip(*lookup.get_proteome_chunks())
+    proteome = b''.join(sequences)
+    # Suffix array is stored as 4 or 8 byte integers depending on proteome size
+    dtype = np.uint32 if len(suffixes[0]) == 4 * len(sequences[0]) else np.int64
+    return proteome, np.concatenate([np.frombuffer(x, dtype=dtype) for x in suffixes])
+
+
+def get_peptide_proteome_positions(proteome, suffixes, pepseq):
+    """Returns positions of a peptide in the proteome, by binary searching
+    the suffix array for the range of suffixes starting with it"""
+    pepseq = pepseq.encode('ascii')
+    peplen = len(pepseq)
+    low, high = 0, len(suffixes)
+    while low < high:
+        mid = (low + high) // 2
+        pos = int(suffixes[mid])
+        if proteome[pos:pos + peplen] < pepseq:
+            low = mid + 1
+        else:
+            high = mid
+    first, high = low, len(suffixes)
+    while low < high:
+        mid = (low + high) // 2
+        pos = int(suffixes[mid])
+        if proteome[pos:pos + peplen] == pepseq:
+            low = mid + 1
+        else:
+            high = mid
+    return suffixes[first:low].tolist()
+
+
+def get_deamidated_proteome_positions(proteome, suffixes, pepseq):
+    """Returns positions of a peptide and all of its D->N deamidated variants
+    in the proteome, by narrowing suffix array ranges one amino acid at a
+    time, and branching to both D and N at every D"""
+    ranges = [(0, len(suffixes))]
+    for offset, aa in enumerate(pepseq.encode('ascii')):
+        aas = (aa, DEAMIDATED) if aa == DEAMIDATES else (aa,)
+        ranges = [narrowed for low, high in ranges for aa in aas
+                  for narrowed in [narrow_suffix_range(proteome, suffixes, low,
+                                                       high, offset, aa)]
+                  if narrowed[0] < narrowed[1]]
+    return [pos for low, high in ranges for pos in suffixes[low:high].tolist()]
+
+
+def narrow_suffix_range(proteome, suffixes, low, high, offset, aa):
+    """Returns the part of a suffix array range, in which suffixes share their
+    first offset amino acids, that has aa at offset"""
+    def get_aa(ix):
+        pos = int(suffixes[ix]) + offset
+        return proteome[pos] if pos < len(proteome) else -1
+    end = high
+    while low < high:
+        mid = (low + high) // 2
+        if get_aa(mid) < aa:
+            low = mid + 1
+        else:
+            high = mid
+    first, high = low, end
+    while low < high:
+        mid = (low + high) // 2
+        if get_aa(mid) <= aa:
+            low = mid + 1
+        else:
+            high = mid
+    return first, low
+
+
+def filter_proteome(elements, proteome, seqtype, ns, deamidation, minpeplen,
+                    enforce_tryp):
+    """Yields peptides from generator as long as they do not match to a protein
+    in the proteome index (see get_proteome_index). Peptides shorter than
+    minpeplen are not matched"""
+    proteome, suffixes = proteome
+    get_positions = {True: get_deamidated_proteome_positions,
+                     False: get_peptide_proteome_positions}[deamidation]
+    for element in elements:
+        seq_matches_protein = False
+        pepseq = get_seq_from_element(element, seqtype, ns)
+        if len(pepseq) >= minpeplen:
+            for pos in get_positions(proteome, suffixes, pepseq):
+                # pepseq is an N-term peptide or tryptic on both ends
+                if not enforce_tryp or pos == 0 or proteome[pos - 1] == SEPARATOR or (
+                        pepseq[-1] in 'KR' and proteome[pos - 1] in TRYPTIC_RESIDUES):
+                    seq_matches_protein = True
+                    break
+        if not seq_matches_protein:
+            yield formatting.serialize_strip_namespace_declaration(element, ns)
 
 
 def filter_whole_proteins(elements, protein_fasta, lookup, seqtype, ns,
                           deamidation, minpeplen, enforce_tryp):
-    whole_proteins = {str(prot.seq).replace('L', 'I'): prot.id for prot in
-                      fasta.parse_fasta(protein_fasta)}
+    """Filters on whole proteins for lookups made before the proteome index
+    existed, which store all peptides of minpeplen length with their protein
+    and position, and need the FASTA file that was used to create them"""
+    whole_proteins = {seq.replace('L', 'I'): acc for acc, header, seq in
+                      fasta.generate_fasta_records(protein_fasta)}
     whole_proteins = {v: k for k, v in whole_proteins.items()}
     for element in elements:
         seq_matches_protein = False
-        element_seqs = get_seqs_from_element(element, seqtype, ns, deamidation)
+        element_seqs = [get_seq_from_element(element, seqtype, ns)]
+        if deamidation:
+            element_seqs = combination_replace(element_seqs[0], 'D', 'N')
         element_prots = {seq: [(protid, pos) for protid, pos in
                                lookup.get_protein_from_pep(seq[:minpeplen])]
                          for seq in element_seqs}
@@ -32,40 +136,65 @@ def filter_whole_proteins(elements, protein_fasta, lookup, seqtype, ns,
                     elif not enforce_tryp:
                         seq_matches_protein = True
                         break
-        if seq_matches_protein:
-            formatting.clear_el(element)
-        else:
-            yield formatting.string_and_clear(element, ns)
+        if not seq_matches_protein:
+            yield formatting.serialize_strip_namespace_declaration(element, ns)
+
+
+def create_searchspace_index(lookup, ntermwildcards, deamidation):
+    """Returns sorted unique hashes of the sequences in a search space lookup.
+    With N-terminal wildcards the lookup contains reversed sequences, for
+    which the hashes of the sequence with 0 up to ntermwildcards N-terminal
+    amino acids removed are stored. For deamidation the hashes are of the
+    sequences with D exchanged for N"""
+    seqs = (seq for seq, in lookup.get_all_seqs())
+    if deamidation:
+        seqs = (seq.replace('D', 'N') for seq in seqs)
+    if ntermwildcards:
+        hashes = (hash(seq[:len(seq) - i][::-1]) for seq in seqs
+                  for i in range(min(ntermwildcards + 1, len(seq))))
+    else:
+        hashes = (hash(seq) for seq in seqs)
+    return np.unique(np.fromiter(hashes, dtype=np.int64))
+
+
+def seq_maybe_in_index(seqindex, seq):
+    """False if a sequence is definitely not in the index, else it has a hash
+    in it and needs an exact check"""
+    seqhash = hash(seq)
+    ix = np.searchsorted(seqindex, seqhash)
+    return ix < len(seqindex) and seqindex[ix] == seqhash
 
 
 def filter_known_searchspace(elements, seqtype, lookup, ns, ntermwildcards,
-                             deamidation):
+                             deamidation, seqindex=False):
     """Yields peptides from generator as long as their sequence is not found in
     known search space dict. Useful for excluding peptides that are found in
-    e.g. ENSEMBL or similar"""
+    e.g. ENSEMBL or similar. When passing a seqindex (see
+    create_searchspace_index), only sequences found in it are looked up.
+    Lookups without a deamidated index are queried for each D->N variant
+    of a sequence, since a D/N equivalence query would scan the table"""
+    variant_lookup = deamidation and not lookup.has_deamidated_index()
     for element in elements:
-        seq_is_known = False
-        for seq in get_seqs_from_element(element, seqtype, ns, deamidation):
-            if lookup.check_seq_exists(seq, ntermwildcards):
-                seq_is_known = True
-                break
-        if seq_is_known:
-            formatting.clear_el(element)
+        seq = get_seq_from_element(element, seqtype, ns)
+        indexseq = seq.replace('D', 'N') if deamidation else seq
+        if seqindex is not False and not seq_maybe_in_index(seqindex, indexseq):
+            seq_is_known = False
+        elif variant_lookup:
+            seq_is_known = any(lookup.check_seq_exists(variant, ntermwildcards)
+                               for variant in combination_replace(seq, 'D', 'N'))
         else:
-            yield formatting.string_and_clear(element, ns)
+            seq_is_known = lookup.check_seq_exists(seq, ntermwildcards, deamidation)
+        if not seq_is_known:
+            yield formatting.serialize_strip_namespace_declaration(element, ns)
 
 
-def get_seqs_from_element(element, seqtype, ns, deamidation):
+def get_seq_from_element(element, seqtype, ns):
         seq = {'psm': reader.get_psm_seq, 'pep': reader.get_peptide_seq}[seqtype](element, ns)
         seq = re.sub('\[UNIMOD:\d*\]', '', seq)
         # Exchange leucines for isoleucines since MS can't differ and we
         # don't want to find 'novel' peptides which only have a difference
         # in this amino acid
-        seq = seq.replace('L', 'I')
-        if deamidation:
-            return combination_replace(seq, 'D', 'N')
-        else:
-            return [seq]
+        return seq.replace('L', 'I')
 
 
 def combination_replace(seq, from_aa, to_aa):
@@ -1,34 +1,56 @@
-from lxml import etree
 import re
 
 from app.readers import xmlformatting as formatting
-from app.readers import percolator as reader
 
 
-def protein_header_split_generator(elements, ns, can_headers, headers):
-    """Loop through proteins of each PSM/peptide. If a protein does not
-    match any of headers, discard PSM/peptide immediately"""
-    for el in elements:
-        header_matching = False
-        can = False
-        for protein in el.findall('{%s}protein_id' % ns['xmlns']):
-            if any(re.search(h, protein.text) for h in can_headers):
-                can = True
-                break #as soon as a canonical match was found break
-            """for classes other than known,
-               check if there is at least one protein matching the specified header
-               and those with matches to the canonical proteins will not be used"""
-            if any(re.search(h, protein.text) for h in headers):
-                    header_matching = True
-        if (header_matching and not can) or ((headers == can_headers) and can):
-            yield formatting.string_and_clear(el, ns)
-        else:
-            formatting.clear_el(el)
+def get_header_classes(protheaders):
+    """Parses header classes to compiled unique header patterns, and for each
+    class a bit mask of the canonical header patterns, a bit mask of the other
+    header patterns, and whether those are the same headers"""
+    patterns, classes = {}, []
+    for headers in protheaders:
+        can_headers = headers.split('|')[0].split(':')[-1].strip(';').split(';')
+        other_headers = headers.split('|')[-1].split(':')[-1].strip(';').split(';')
+        masks = []
+        for classheaders in [can_headers, other_headers]:
+            mask = 0
+            for header in classheaders:
+                mask |= 1 << patterns.setdefault(header, len(patterns))
+            masks.append(mask)
+        classes.append((*masks, can_headers == other_headers))
+    return [re.compile(x) for x in patterns], classes
 
 
-def split_protein_header_id_type(elements, ns, protheaders):
-    can_headers = protheaders.split('|')[0].split(':')[-1].strip(';').split(';')
-    other_headers = protheaders.split('|')[-1].split(':')[-1].strip(';').split(';')
-    return {x: protein_header_split_generator(elements[x], ns, can_headers, other_headers)
-            for x in ['psm', 'peptide']}
+def get_element_classes(protein_matches, classes):
+    """Classes with the same canonical and other headers contain elements with
+    a protein matching these. Other classes contain elements with a protein
+    matching the other headers, and no protein matching the canonical ones"""
+    return [ix for ix, (can_mask, other_mask, same_headers) in enumerate(classes)
+            if (same_headers and protein_matches & can_mask) or (not same_headers
+                and not protein_matches & can_mask and protein_matches & other_mask)]
+
 
+def split_protein_header_id_type(elements, ns, protheaders):
+    """Splits PSMs and peptides from a single generator of (type, element) into
+    header classes. Header patterns are matched once per protein, and the
+    matches for all proteins of an element are combined. Yields elements'
+    type, XML string and list of the indices of classes they belong to"""
+    patterns, classes = get_header_classes(protheaders)
+    protein_tag = '{%s}protein_id' % ns['xmlns']
+    protein_pattern_matches = {}
+    for feattype, el in elements:
+        matches = 0
+        for protein in el.iterfind(protein_tag):
+            try:
+                matches |= protein_pattern_matches[protein.text]
+            except KeyError:
+                protmatches = 0
+                for ix, pattern in enumerate(patterns):
+                    if pattern.search(protein.text):
+                        protmatches |= 1 << ix
+                protein_pattern_matches[protein.text] = protmatches
+                matches |= protmatches
+        elclasses = get_element_classes(matches, classes)
+        if elclasses:
+            yield (feattype, formatting.serialize_strip_namespace_declaration(
+                el, ns), elclasses)
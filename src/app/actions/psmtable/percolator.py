@@ -1,49 +1,128 @@
 import os
+import re
+import sys
+
+import numpy as np
+
 from app.readers import mzidplus as readers
 from app.readers import tsv as tsvreader
 from app.readers import xml
 from app.readers import percolator as percoreader 
 from app.dataformats import mzidtsv as psmheaders
+from app.lookups import base as lookups
+from app.writers import tsv as writer
+from app.actions.psmtable import filtering
+
+# percolator psm ID is: samplename_SII_scanindex_rank_scannr_charge_rank
+PERCO_PSMID = re.compile(r'(.+)_SII_(\d+)_(\d+)_(\d+)_(\d+)_\3$')
+MZID_SII_ID = re.compile(r'SII_(\d+)_(\d+)$')
+MZID_SCAN = re.compile(r'(?:^| )scan=([^ =]*)')
+MOD_WEIGHT = re.compile(r'[+-]\d+(?:\.\d+)?')
+MZID_INDEX_SUFFIX = '.psmindex.sqlite'
+# Percolator q-value data for perco2psm worker processes
+WORKER_PERCODATA = {}
 
 
 def calculate_target_decoy_competition(percofn):
     """From a percolator XML output file, use its svm scores to calculate an FDR
-    using TD-competition (not percolator's mixmax method). Output 
-    can be used
-    to deliver 
+    using TD-competition (not percolator's mixmax method). Returns a dict with
+    a PSM key (see get_percolator_psm_key) -> index map and arrays of svm score, decoy status, PSM and
+    peptide q-values by that index.
     """
     # TODO add option to calculate FDR or not (percolator default one)
     ns = xml.get_namespace_from_top(percofn, None)
-    # First calculate PSM FDRs
-    psms = {
-            p.attrib['{%s}psm_id' % ns['xmlns']]: (
-                float(p.find('{%s}svm_score' % ns['xmlns']).text),
-                p.attrib['{%s}decoy' % ns['xmlns']] == 'true')
-            for p in percoreader.generate_psms(percofn, ns)
-            }
-    decoys = {True: 0, False: 0}
-    for psm in sorted([(pid, score, decoy) for pid, (score, decoy) in psms.items()], reverse=True, key=lambda x:x[1]):
-        decoys[psm[2]] += 1
+    psms, peptides = percoreader.get_psm_peptide_scores(percofn, ns)
+    psm_ix = {psm_id: ix for ix, psm_id in enumerate(psms['ids'])}
+    # PSMs not in a peptide get a peptide q-value of 1
+    pepqvals = np.full(len(psm_ix), np.inf)
+    for pepq, psm_ids in zip(get_tdc_qvalues(peptides['svm'], peptides['decoy']),
+                             peptides['psm_ids']):
         try:
-            psms[psm[0]] = {'decoy': psm[2], 'svm': psm[1], 'qval': min(decoys[True]/decoys[False], 1)}  # T-TDC
-        except ZeroDivisionError:
-            psms[psm[0]] = {'decoy': psm[2], 'svm': psm[1], 'qval': 1}  # T-TDC
-    # Then calculate peptide FDRs
-    decoys = {'true': 0, 'false': 0}
-    for svm, decoy, psm_ids in sorted([(float(x.find('{%s}svm_score' % ns['xmlns']).text), x.attrib['{%s}decoy' % ns['xmlns']], x.find('{%s}psm_ids' % ns['xmlns'])) for x in percoreader.generate_peptides(percofn, ns)], reverse=True, key=lambda x:x[0]):
-        decoys[decoy] += 1
-        for pid in psm_ids:
-            try:
-                psms[pid.text]['pepqval'] = min(decoys['true']/decoys['false'], 1)
-            except ZeroDivisionError:
-                psms[pid.text]['pepqval'] = 1
-            except KeyError:
-                # Edgecase, sometimes filtering percolator data causes this:
-                # when there is a peptide with a PSM ID not in percolator PSMs 
-                # set all its PSMs pep-q-values to 1
-                [psms[x].update({'pepqval': 1}) for x in psm_ids if x in psms]
-                break
-    return psms
+            pepqvals[[psm_ix[x] for x in psm_ids]] = pepq
+        except KeyError:
+            # Edgecase, sometimes filtering percolator data causes this:
+            # when there is a peptide with a PSM ID not in percolator PSMs 
+            # set all its PSMs pep-q-values to 1
+            pepqvals[[psm_ix[x] for x in psm_ids if x in psm_ix]] = np.inf
+    psm_ix = {get_percolator_psm_key(psm_id): ix for psm_id, ix in psm_ix.items()}
+    return {'ids': psm_ix, 'svm': psms['svm'], 'decoy': psms['decoy'],
+            'qval': get_tdc_qvalues(psms['svm'], psms['decoy']),
+            'pepqval': pepqvals}
+
+
+def get_tdc_qvalues(scores, decoys):
+    """Returns T-TDC decoy/target ratios in input order, with scores ranked
+    from high to low (stable for ties). When no targets have been seen the
+    ratio is inf, q-values are capped at 1 on output with get_qvalue"""
+    order = np.argsort(-scores, kind='stable')
+    ranked_decoys = decoys[order]
+    with np.errstate(divide='ignore'):
+        ratios = np.cumsum(ranked_decoys) / np.cumsum(~ranked_decoys)
+    qvals = np.empty(len(ratios))
+    qvals[order] = ratios
+    return qvals
+
+
+def get_qvalue(ratio):
+    return min(float(ratio), 1)
+
+
+def get_percolator_psm_key(psm_id):
+    """Returns a tuple of (specfile, scanindex, rank, scannr, charge) from a
+    percolator PSM ID, or the ID itself when it is not formatted like that"""
+    match = PERCO_PSMID.match(psm_id)
+    if match is None:
+        return psm_id
+    fn, scanindex, rank, scan, charge = match.groups()
+    return (sys.intern(fn), sys.intern(scanindex), sys.intern(rank), int(scan),
+            sys.intern(charge))
+
+
+def generate_mzid_psm_ids(mzid_specidr, mzns):
+    """Yields each SpectrumIdentificationItem of the mzIdentML results, with
+    its result element, and scan index, rank and scan number as used by
+    percolator in its PSM IDs"""
+    scan = 0
+    sii_tag = '{%s}SpectrumIdentificationItem' % mzns['xmlns']
+    for specidr in mzid_specidr:
+        scanmatch = MZID_SCAN.search(specidr.attrib['spectrumID'])
+        for specidi in specidr.iterfind(sii_tag):
+            if scanmatch is not None:
+                scan = int(scanmatch.group(1))
+            else:
+                # in e.g. timstof data there are no true scan numbers, percolator sets it by increment
+                scan += 1
+            scanindex, rank = MZID_SII_ID.match(specidi.attrib['id']).groups()
+            yield specidr, specidi, scanindex, rank, scan
+
+
+def set_worker_percodata(percodata):
+    WORKER_PERCODATA.update(percodata)
+
+
+def write_percolator_psmtable(fns, filtpsm, filtpep, mzidindex=False,
+                              percodata=False):
+    """Annotates a PSM table with percolator data and FDR from its matching
+    mzIdentML, and writes it to outfn"""
+    psmfn, mzidfn, outfn = fns
+    percodata = percodata or WORKER_PERCODATA
+    oldheader = tsvreader.get_tsv_header(psmfn)
+    header = get_header_with_percolator(oldheader)
+    psms = tsvreader.generate_split_tsv_lines(psmfn, oldheader)
+    if mzidindex:
+        psms_perco = add_fdr_to_indexed_mzidtsv(
+            psms, get_mzid_psm_index(mzidfn), percodata)
+    else:
+        mzns = readers.get_mzid_namespace(mzidfn)
+        mzidsr = readers.mzid_spec_result_generator(mzidfn, mzns)
+        psms_perco = add_fdr_to_mzidtsv(psms, mzidsr, mzns, percodata)
+    if filtpsm:
+        psms_perco = filtering.filter_psms_conf(psms_perco, psmheaders.HEADER_PSMQ,
+                filtpsm, True)
+    if filtpep:
+        psms_perco = filtering.filter_psms_conf(psms_perco, psmheaders.HEADER_PEPTIDE_Q,
+                filtpep, True)
+    writer.write_tsv(header, psms_perco, outfn)
 
 
 def add_fdr_to_mzidtsv(psms, mzid_specidr, mzns, percodata):
@@ -53,38 +132,105 @@ def add_fdr_to_mzidtsv(psms, mzid_specidr, mzns, percodata):
     Mix-max FDR and instead use target-decoy competition.
     """
     # mzId results and PSM lines can be zipped
-    scan = 0
-    for specidr in mzid_specidr:
-        for specidi in specidr.findall('{%s}SpectrumIdentificationItem' % mzns['xmlns']):
-            psm = next(psms)
-            # percolator psm ID is: samplename_SII_scanindex_rank_scannr_charge_rank
-            scanindex, rank = specidi.attrib['id'].replace('SII_', '').split('_')
-            try:
-                scan = int({x.split('=')[0]: x.split('=')[1] for x in specidr.attrib['spectrumID'].split(' ')}['scan'])
-            except KeyError:
-                # in e.g. timstof data there are no true scan numbers, percolator sets it by increment
-                scan += 1
-            spfile = os.path.splitext(psm[psmheaders.HEADER_SPECFILE])[0]
-            try:
-                percopsm = percodata['{fn}_SII_{ix}_{rk}_{sc}_{ch}_{rk}'.format(fn=spfile, ix=scanindex, sc=scan, rk=rank, ch=psm['Charge'])]
-            except KeyError:
-                continue
-            outpsm = {k: v for k,v in psm.items()}
-            outpsm.update({
-                psmheaders.HEADER_SVMSCORE: percopsm['svm'], 
-                psmheaders.HEADER_PSMQ: percopsm['qval'], 
-                psmheaders.HEADER_PEPTIDE_Q: percopsm['pepqval'], 
-                psmheaders.HEADER_TARGETDECOY: 'decoy' if percopsm['decoy'] else 'target', 
-                })
-            # Remove all decoy protein matches from target proteins, to ensure downstream
-            # processing does not trip up on them, e.g. having a decoy master protein.
-            if not percopsm['decoy']:
-                outprots = []
-                for prot in outpsm[psmheaders.HEADER_PROTEIN].split(';'):
-                    if not prot.startswith(psmheaders.DECOY_PREFIX):
-                        outprots.append(prot)
-                outpsm[psmheaders.HEADER_PROTEIN] = ';'.join(outprots)
-            yield outpsm
+    specfiles = {}
+    for _, _, scanindex, rank, scan in generate_mzid_psm_ids(mzid_specidr, mzns):
+        psm = next(psms)
+        if add_percolator_to_psm(psm, scanindex, rank, scan, percodata, specfiles):
+            yield psm
+
+
+def add_fdr_to_indexed_mzidtsv(psms, mzidindex, percodata):
+    """Like add_fdr_to_mzidtsv, but PSMs are looked up by spectra file,
+    spectrum ID, charge and peptide in an index of the mzIdentML, so the
+    TSV can be filtered, sorted or concatenated"""
+    specfiles = {}
+    for psm in psms:
+        mzidpsm = mzidindex.get_psm(psm[psmheaders.HEADER_SPECFILE],
+                                    psm[psmheaders.HEADER_SPECSCANID],
+                                    psm[psmheaders.HEADER_CHARGE],
+                                    normalize_peptide_mods(psm[psmheaders.HEADER_PEPTIDE]))
+        if mzidpsm is not None and add_percolator_to_psm(psm, *mzidpsm, percodata,
+                                                         specfiles):
+            yield psm
+
+
+def add_percolator_to_psm(psm, scanindex, rank, scan, percodata, specfiles):
+    """Adds percolator svm score, q-values and target/decoy status to a PSM,
+    returns False if it is not in the percolator data. specfiles is a cache
+    of spectra file names without extension"""
+    specfile = psm[psmheaders.HEADER_SPECFILE]
+    try:
+        spfile = specfiles[specfile]
+    except KeyError:
+        spfile = specfiles[specfile] = sys.intern(os.path.splitext(specfile)[0])
+    try:
+        ix = percodata['ids'][(spfile, scanindex, rank, scan, psm['Charge'])]
+    except KeyError:
+        return False
+    decoy = percodata['decoy'][ix]
+    # PSM dicts are not reused by the TSV reader, update in place
+    psm.update({
+        psmheaders.HEADER_SVMSCORE: float(percodata['svm'][ix]),
+        psmheaders.HEADER_PSMQ: get_qvalue(percodata['qval'][ix]),
+        psmheaders.HEADER_PEPTIDE_Q: get_qvalue(percodata['pepqval'][ix]),
+        psmheaders.HEADER_TARGETDECOY: 'decoy' if decoy else 'target', 
+        })
+    # Remove all decoy protein matches from target proteins, to ensure downstream
+    # processing does not trip up on them, e.g. having a decoy master protein.
+    proteins = psm[psmheaders.HEADER_PROTEIN]
+    if not decoy and psmheaders.DECOY_PREFIX in proteins:
+        psm[psmheaders.HEADER_PROTEIN] = ';'.join(
+                [prot for prot in proteins.split(';')
+                 if not prot.startswith(psmheaders.DECOY_PREFIX)])
+    return True
+
+
+def get_mzid_psm_index(mzidfn):
+    """Returns lookup of the PSMs in an mzIdentML, stored next to it. It is
+    (re)created when missing or older than the mzIdentML, in a temporary file
+    first so an interrupted or concurrent run does not leave a partial index"""
+    indexfn = mzidfn + MZID_INDEX_SUFFIX
+    if (not os.path.exists(indexfn) or
+            os.path.getmtime(indexfn) < os.path.getmtime(mzidfn)):
+        tmpfn = '{}.{}.tmp'.format(indexfn, os.getpid())
+        lookup = lookups.create_new_lookup(tmpfn, 'mzidindex')
+        lookup.add_tables([])
+        store_mzid_psm_index(mzidfn, lookup)
+        lookup.close_connection()
+        os.replace(tmpfn, indexfn)
+    return lookups.get_lookup(indexfn, 'mzidindex')
+
+
+def store_mzid_psm_index(mzidfn, lookup):
+    """Stores spectra file, spectrum ID, charge, peptide, and scan index, rank
+    and scan number as in percolator PSM IDs, of all PSMs in an mzIdentML"""
+    mzns = readers.get_mzid_namespace(mzidfn)
+    xmlns = '{%s}' % mzns['xmlns']
+    specfiles, peptides = {}, {}
+
+    def generate_spec_results():
+        for tag, el in readers.generate_mzid_psm_elements(mzidfn, mzns):
+            if tag == 'SpectraData':
+                specfiles[el.attrib['id']] = el.attrib['name']
+            elif tag == 'Peptide':
+                pep_id, seq = readers.get_mzid_peptidedata(el, xmlns)
+                peptides[pep_id] = seq
+            else:
+                yield el
+    lookup.store_psms(
+        (specfiles[specidr.attrib['spectraData_ref']],
+         specidr.attrib['spectrumID'], specidi.attrib['chargeState'],
+         peptides[specidi.attrib['peptide_ref']], scanindex, rank, scan)
+        for specidr, specidi, scanindex, rank, scan in
+        generate_mzid_psm_ids(generate_spec_results(), mzns))
+    lookup.index_psms()
+
+
+def normalize_peptide_mods(peptide):
+    """Rounds modification masses in a TSV peptide sequence like they are in
+    the mzIdentML index"""
+    return MOD_WEIGHT.sub(lambda x: readers.format_mod_weight(x.group()),
+                          peptide)
 
 
 def get_header_with_percolator(oldheader):
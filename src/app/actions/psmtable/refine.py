@@ -1,7 +1,11 @@
+import os
 import re
+from math import isnan
 from hashlib import md5
 from collections import OrderedDict
 
+import numpy as np
+
 from app.readers import tsv as tsvreader
 from app.readers import fasta as fastareader
 from app.dataformats import mzidtsv as mzidtsvdata
@@ -9,6 +13,8 @@ from app.dataformats import mzidtsv as mzidtsvdata
 from app.lookups.sqlite import psms as lookups
 
 DB_STORE_CHUNK = 100000
+# Mass shift of a modification, e.g. +15.995
+MOD_PATTERN = re.compile(r'[\+\-]\d*.\d*')
 
 
 def create_header(oldheader, genes, proteingroup, precursor, isob_header, bioset,
@@ -72,7 +78,16 @@ def get_fasta_md5(fastafn):
     return fasta_md5.hexdigest()
 
 
-def store_proteins_descriptions(pgdb, fastafn, fastamd5, tsvfn, header, fastadelim, genefield):
+def store_proteins_descriptions(pgdb, fastafn, fastamd5, tsvfn, header, fastadelim,
+        genefield, fastacache=False):
+    """Stores proteins from the PSM table, or proteins and their annotation
+    from a FASTA file. With a fastacache directory, the FASTA data is copied
+    from a cache file for its md5 when it exists, else it is created there"""
+    if fastacache and fastafn:
+        cachefn = get_fasta_cache_fn(fastacache, fastamd5, fastadelim, genefield)
+        if os.path.exists(cachefn):
+            pgdb.store_fasta_from_cache(fastafn, fastamd5, cachefn)
+            return set(pgdb.get_protids())
     if not fastafn:
         prots = {}
         for psm in tsvreader.generate_split_tsv_lines(tsvfn, header):
@@ -84,9 +99,23 @@ def store_proteins_descriptions(pgdb, fastafn, fastamd5, tsvfn, header, fastadel
         prots, seqs, desc, evids, ensgs, symbols = fastareader.get_proteins_for_db(
             fastafn, fastadelim, genefield)
         pgdb.store_fasta(fastafn, fastamd5, prots, evids, seqs, desc, ensgs, symbols)
+        if fastacache:
+            # Write to a temporary file first so concurrent runs do not read
+            # a partial cache
+            os.makedirs(fastacache, exist_ok=True)
+            tmpfn = '{}.{}.tmp'.format(cachefn, os.getpid())
+            pgdb.write_fasta_cache(tmpfn)
+            os.replace(tmpfn, cachefn)
     return set([x[0] for x in prots])
 
 
+def get_fasta_cache_fn(fastacache, fastamd5, fastadelim, genefield):
+    """Cache files are keyed by the FASTA md5, and the header delimiter and
+    field which determine its gene names"""
+    genekey = md5('{}\t{}'.format(fastadelim, genefield).encode()).hexdigest()[:8]
+    return os.path.join(fastacache, 'fasta_{}_{}.sqlite'.format(fastamd5, genekey))
+
+
 def store_psm_protein_relations(fn, header, pgdb, proteins, specfncol):
     """Reads PSMs from file, extracts their proteins and peptides and passes
     them to a database backend in chunks.
@@ -536,65 +565,63 @@ def get_protein_group_content(pgmap, master):
 
 
 def generate_psms_quanted(quantdb, shiftrows, psms, isob_header, isobaric=False, precursor=False):
-    """Takes dbfn and connects, gets quants for each line in tsvfn, sorts
-    them in line by using keys in quantheader list."""
-    allquants, sqlfields = quantdb.select_all_psm_quants(shiftrows, isobaric, precursor)
-    quant = next(allquants)
+    """Takes dbfn and connects, loads quants for all PSM rows into arrays
+    indexed by row number (one scan per quant table), and adds them to the
+    PSMs in the order of the keys in the quantheader list."""
+    nrrows = quantdb.get_highest_rownr() + 1 - shiftrows
+    if isobaric:
+        channel_ix = {ch_id: isob_header.index(ch_name) for ch_id, ch_name
+                      in quantdb.get_isobaric_channel_ids()}
+        isoquants = get_quant_array(quantdb.get_isobaric_quant_rows(shiftrows),
+                                    shiftrows, nrrows, len(isob_header), channel_ix)
+    if precursor:
+        ms1quants = get_quant_array(quantdb.get_precursor_quant_rows(shiftrows),
+                                    shiftrows, nrrows, 2)
     for rownr, psm in enumerate(psms):
-        rownr += shiftrows
         outpsm = {x: y for x, y in psm.items()}
         if precursor:
-            pquant = [quant[sqlfields['precursor']], quant[sqlfields['fwhm']]]
-            pquant = ['NA' if x is None else x for x in pquant]
+            pquant, fwhm = format_quants(ms1quants[rownr])
             outpsm.update({
-                mzidtsvdata.HEADER_PRECURSOR_QUANT: str(pquant[0]),
-                mzidtsvdata.HEADER_PRECURSOR_FWHM: str(pquant[1]),
+                mzidtsvdata.HEADER_PRECURSOR_QUANT: pquant,
+                mzidtsvdata.HEADER_PRECURSOR_FWHM: fwhm,
                 })
         if isobaric:
-            isoquants = {}
-            while quant[0] == rownr:
-                isoquants.update({quant[sqlfields['isochan']]:
-                                  str(quant[sqlfields['isoquant']])})
-                try:
-                    quant = next(allquants)
-                except StopIteration:
-                    # last PSM, break from while loop or it is not yielded at all
-                    break
-            outpsm.update(get_quant_NAs(isoquants, isob_header))
-        else:
-            try:
-                quant = next(allquants)
-            except StopIteration:
-                # last PSM, needs explicit yield/break or it will not be yielded
-                yield outpsm
-                break
+            outpsm.update(zip(isob_header, format_quants(isoquants[rownr])))
         yield outpsm
 
 
-def get_quant_NAs(quantdata, quantheader):
-    """Takes quantdata in a dict and header with quantkeys
-    (eg iTRAQ isotopes). Returns dict of quant intensities
-    with missing keys set to NA."""
-    out = {}
-    for qkey in quantheader:
-        out[qkey] = quantdata.get(qkey, 'NA')
-    return out
-
-
-def count_missed_cleavage(full_pepseq, count=0):
-    '''Regex .*[KR][^P] matches until the end and checks if there is a final
-    charachter so this will not match the tryptic residue'''
-    pepseq = re.sub('[\+\-]\d*.\d*', '', full_pepseq)
-    match = re.match('.*[KR][^P]', pepseq)
-    if match:
-        count += 1
-        return count_missed_cleavage(match.group()[:-1], count)
-    else:
-        return count
+def get_quant_array(quantrows, shiftrows, nrrows, nrcols, col_ix=False):
+    """Fills an array of rows x quant columns with quant data from a cursor
+    of (rownr, value, ...) or, when passing a column index map, of
+    (rownr, column, value). Missing quant is NaN"""
+    quants = np.full((nrrows, nrcols), np.nan)
+    for chunk in iter(lambda: quantrows.fetchmany(DB_STORE_CHUNK), []):
+        chunk = np.array(chunk, dtype=float)
+        rows = chunk[:, 0].astype(int) - shiftrows
+        if col_ix:
+            cols = np.array([col_ix[int(x)] for x in chunk[:, 1]], dtype=int)
+            quants[rows, cols] = chunk[:, 2]
+        else:
+            quants[rows] = chunk[:, 1:]
+    return quants
+
+
+def format_quants(quants):
+    return ['NA' if isnan(x) else str(x) for x in quants.tolist()]
+
+
+def count_missed_cleavage(full_pepseq):
+    '''Counts K and R that are followed by an amino acid which is not P, i.e.
+    all but a C-terminal tryptic residue, in a peptide without modifications'''
+    pepseq = MOD_PATTERN.sub('', full_pepseq)
+    return (pepseq[:-1].count('K') + pepseq[:-1].count('R') -
+            pepseq.count('KP') - pepseq.count('RP'))
 
 
 def generate_psms_spectradata(lookup, shiftrows, psms, bioset, miscleav):
     psm_specdata = zip(enumerate(psms), lookup.get_exp_spectra_data_rows(shiftrows))
+    # Peptides occur in many PSMs, count their missed cleavages once
+    missed_cleavages = {}
     for (row, psm), specdata in psm_specdata:
         row += shiftrows
         outpsm = {x: y for x, y in psm.items()}
@@ -611,5 +638,10 @@ def generate_psms_spectradata(lookup, shiftrows, psms, bioset, miscleav):
             raise RuntimeError('PSM with row nr {} has no rownr in DB. '
                                'Current DB row is {}'.format(row, specdata[0]))
         if miscleav:
-            outpsm[mzidtsvdata.HEADER_MISSED_CLEAVAGE] = count_missed_cleavage(outpsm[mzidtsvdata.HEADER_PEPTIDE])
+            pepseq = outpsm[mzidtsvdata.HEADER_PEPTIDE]
+            try:
+                outpsm[mzidtsvdata.HEADER_MISSED_CLEAVAGE] = missed_cleavages[pepseq]
+            except KeyError:
+                outpsm[mzidtsvdata.HEADER_MISSED_CLEAVAGE] = count_missed_cleavage(pepseq)
+                missed_cleavages[pepseq] = outpsm[mzidtsvdata.HEADER_MISSED_CLEAVAGE]
         yield outpsm
@@ -1,18 +1,44 @@
-from Bio import SeqIO
-from Bio.Seq import Seq
-from random import shuffle
+from operator import add
+from functools import partial
+from multiprocessing import Pool
+from random import Random, getrandbits
 
+from app.readers import fasta as fastareader
 
-def create_trypsinized(proteins, proline_cut=False, miss_cleavage=0, minlen=0):
-    for proseq in proteins:
-        trypnr = 0
-        outpeps = trypsinize(str(proseq.seq), proline_cut, miss_cleavage)
-        if minlen:
-            outpeps = [pep for pep in outpeps if len(pep) >= minlen]
-        for pep in outpeps:
-            trypnr += 1
-            trypseq = SeqIO.SeqRecord(Seq(pep), id='{}_{}'.format(proseq.id, trypnr), name=proseq.name, description='')
-            yield trypseq
+# Amount of proteins per worker task when digesting in parallel
+DIGEST_CHUNK = 1000
+# Target search space for makedecoy worker processes
+WORKER_TARGETS = {}
+
+
+def create_trypsinized(proteins, proline_cut=False, miss_cleavage=0, minlen=0,
+                       processes=1):
+    """Yields (header, sequence) of tryptic peptides of proteins (accession,
+    header, sequence), with processes > 1 chunks of proteins are trypsinized
+    in parallel, output stays in input order"""
+    digest = partial(trypsinize_protein, proline_cut=proline_cut,
+                     miss_cleavage=miss_cleavage, minlen=minlen)
+    if processes > 1:
+        with Pool(processes) as pool:
+            yield from generate_peptide_records(pool.imap(digest, proteins,
+                                                          DIGEST_CHUNK))
+    else:
+        yield from generate_peptide_records(map(digest, proteins))
+
+
+def trypsinize_protein(protein, proline_cut, miss_cleavage, minlen):
+    """Returns protein (accession, header, sequence) as (accession, peptides)"""
+    protid, header, proseq = protein
+    outpeps = trypsinize(proseq, proline_cut, miss_cleavage)
+    if minlen:
+        outpeps = [pep for pep in outpeps if len(pep) >= minlen]
+    return protid, outpeps
+
+
+def generate_peptide_records(proteins):
+    for protid, outpeps in proteins:
+        for trypnr, pep in enumerate(outpeps, 1):
+            yield '{}_{}'.format(protid, trypnr), pep
 
 
 def trypsinize(proseq, proline_cut=False, miss_cleavage=0):
@@ -20,36 +46,35 @@ def trypsinize(proseq, proline_cut=False, miss_cleavage=0):
     """Trypsinize a protein sequence. Returns a list of peptides.
     Peptides include both cut and non-cut when P is behind a tryptic
     residue. Number of missed cleavages can be specified.
+    Fully tryptic peptides come first, then those with 1, 2, etc missed
+    cleavages, each in protein order.
     """
-    #if not set(str(proseq.seq[1:-1])).intersection('RK'):
-    #    return [str(proseq.seq)]
-    outpeps = []
-    trypres = set(['K', 'R'])
-    noncutters = set()
+    if not proseq:
+        return []
+    # Mark cleavage sites with newlines and split, string methods are much
+    # faster than looping over residues in Python
+    cut = proseq.replace('K', 'K\n').replace('R', 'R\n')
     if not proline_cut:
-        noncutters.add('P')
-    peptide = ''
-    for i, aa in enumerate(proseq):
-        peptide += aa
-        if i == len(proseq) - 1:
-            outpeps.append(peptide)
-        elif aa in trypres and proseq[i + 1] not in noncutters:
-            outpeps.append(peptide)  # do actual cut by storing peptides
-            peptide = ''
-        
-    ft_pep_amount = len(outpeps)
+        cut = cut.replace('\nP', 'P')
+    outpeps = cut.rstrip('\n').split('\n')
+    # Peptides with i missed cleavages are the ones with i - 1, joined with
+    # the next fully tryptic peptide
+    fully_tryptic = missed = outpeps[:]
     for i in range(1, miss_cleavage + 1):
-        for j, pep in enumerate([x for x in outpeps]):
-            if j + i < ft_pep_amount:
-                outpeps.append(''.join([x for x in (outpeps[j:j + i + 1])]))
+        missed = list(map(add, missed, fully_tryptic[i:]))
+        outpeps.extend(missed)
     return outpeps
 
 
-def tryp_rev(seq, lookup, do_trypsinize, miss_cleavage, minlen, max_shuffle):
+def tryp_rev(proseq, lookup, do_trypsinize, miss_cleavage, minlen, max_shuffle,
+             shuffle):
+    """Returns the decoy of a protein sequence, reversing each tryptic peptide
+    and shuffling those that match a target peptide with shuffle, or False
+    when no decoy peptides are left"""
     if do_trypsinize:
-        segments = trypsinize(seq, miss_cleavage=miss_cleavage)
+        segments = trypsinize(proseq, miss_cleavage=miss_cleavage)
     else:
-        segments = [str(seq.seq)]
+        segments = [proseq]
     final_seq = {}
     decoy_segs = {}
     for i, s in enumerate(segments):
@@ -68,7 +93,7 @@ def tryp_rev(seq, lookup, do_trypsinize, miss_cleavage, minlen, max_shuffle):
         shufflecount = 0
         targets, tests = True, {k: (v, 0, v) for k,v in decoy_segs.items()}
         while targets:
-            targets = lookup.get_multi_seq([x[0] for x in tests.values()])
+            targets = get_target_matches(lookup, [x[0] for x in tests.values()])
             for i, (s, shufcount, origdecoy) in [(k,v) for k,v in tests.items()]: # list comprehension to not have dict change during iteration
                 if s not in targets:
                     decoy_segs[i] = tests.pop(i)[0]
@@ -81,34 +106,88 @@ def tryp_rev(seq, lookup, do_trypsinize, miss_cleavage, minlen, max_shuffle):
                     tests.pop(i)
                     nr_decoymatching += 1
     if set(decoy_segs.values()) != {''}:
-        seq.seq = Seq(''.join([decoy_segs[i] for i in range(0, len(decoy_segs))]))
-        seq.id = 'decoy_{}'.format(seq.name)
-        seq.description = 'decoy_{}'.format(seq.description)
+        decoyseq = ''.join([decoy_segs[i] for i in range(0, len(decoy_segs))])
     else:
-        seq = False
-    return seq, nr_decoymatching, nr_peptides
+        decoyseq = False
+    return decoyseq, nr_decoymatching, nr_peptides
+
 
+def get_target_matches(lookup, seqs):
+    """Returns the seqs that are in the target search space, which is either
+    a lookup or an in-memory set of peptides"""
+    if isinstance(lookup, set):
+        return lookup.intersection(seqs)
+    return lookup.get_multi_seq(seqs)
 
-def prot_rev(seq):
-    seq.id = 'decoy_{}'.format(seq.name)
-    seq = seq[::-1]
-    return seq
 
+def set_worker_targets(lookup):
+    if lookup is not None and not isinstance(lookup, set):
+        # Forked workers can not share the SQLite connection
+        lookup.connect(lookup.get_fn())
+    WORKER_TARGETS['lookup'] = lookup
 
-def create_decoy_fa(fastafn, method, lookup, is_trypsinized, miss_cleavage, minlen, max_shuffle):
-    outfasta = SeqIO.parse(fastafn, 'fasta')
+
+def create_decoy(protein, method, do_trypsinize, miss_cleavage, minlen,
+                 max_shuffle, seed, lookup=False):
+    """Returns a decoy (header, sequence) of a protein (accession, header,
+    sequence), with the amount of decoy peptides that could not be shuffled
+    away from target peptides and the total amount of peptides. Shuffling
+    uses a random generator seeded by seed and protein accession, so decoys
+    do not depend on which process makes them"""
+    protid, header, proseq = protein
+    decoyid = 'decoy_{}'.format(protid)
     if method == 'prot_rev':
-        for seq in outfasta:
-            yield prot_rev(seq)
-    if method == 'tryp_rev':
-        decoymatching, nr_peptides = 0, 0
-        outtryp = (tryp_rev(x, lookup, is_trypsinized, miss_cleavage, minlen, 
-            max_shuffle) for x in outfasta)
-        for seq, nr_decoymatching, nr_pep in outtryp:
-            decoymatching += nr_decoymatching
-            nr_peptides += nr_pep
-            if seq:
-                yield seq
-        if decoymatching:
-            print('Unable to shuffle {} decoys (of a total of {} decoy peptides) '
-                    'that matched target DB (retained non-shuffled)'.format(decoymatching, nr_peptides))
+        return (get_decoy_header(decoyid, header), proseq[::-1]), 0, 0
+    lookup = WORKER_TARGETS['lookup'] if lookup is False else lookup
+    rng = Random('{}_{}'.format(seed, protid))
+    decoyseq, nr_decoymatching, nr_peptides = tryp_rev(
+        proseq, lookup, do_trypsinize, miss_cleavage, minlen, max_shuffle,
+        rng.shuffle)
+    if decoyseq:
+        decoy = (get_decoy_header(decoyid, 'decoy_{}'.format(header)), decoyseq)
+    else:
+        decoy = False
+    return decoy, nr_decoymatching, nr_peptides
+
+
+def get_decoy_header(decoyid, description):
+    """Returns the header of a decoy as Biopython wrote it for a record with
+    decoyid and description, so output does not change"""
+    if description and description.split(None, 1)[0] == decoyid:
+        return description
+    elif description:
+        return '{} {}'.format(decoyid, description)
+    return decoyid
+
+
+def create_decoy_fa(fastafn, method, lookup, is_trypsinized, miss_cleavage,
+                    minlen, max_shuffle, seed=None, processes=1):
+    """Yields (header, sequence) of decoy proteins of a FASTA file, with
+    processes > 1 they are created in parallel, output is identical for any
+    amount of processes"""
+    if seed is None:
+        seed = getrandbits(64)
+    make_decoy = partial(create_decoy, method=method, do_trypsinize=is_trypsinized,
+                         miss_cleavage=miss_cleavage, minlen=minlen,
+                         max_shuffle=max_shuffle, seed=seed)
+    proteins = fastareader.generate_fasta_records(fastafn)
+    if processes > 1:
+        with Pool(processes, initializer=set_worker_targets,
+                  initargs=(lookup,)) as pool:
+            yield from generate_decoy_records(pool.imap(make_decoy, proteins,
+                                                        DIGEST_CHUNK))
+    else:
+        yield from generate_decoy_records(make_decoy(x, lookup=lookup)
+                                          for x in proteins)
+
+
+def generate_decoy_records(decoys):
+    decoymatching, nr_peptides = 0, 0
+    for decoy, nr_decoymatching, nr_pep in decoys:
+        decoymatching += nr_decoymatching
+        nr_peptides += nr_pep
+        if decoy:
+            yield decoy
+    if decoymatching:
+        print('Unable to shuffle {} decoys (of a total of {} decoy peptides) '
+                'that matched target DB (retained non-shuffled)'.format(decoymatching, nr_peptides))
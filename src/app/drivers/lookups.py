@@ -3,7 +3,6 @@ from app.drivers.options import lookup_options, sequence_options
 
 from app.readers import spectra as spectrareader
 from app.readers import openms as openmsreader
-from app.readers import tsv as tsvreader
 
 from app.actions.lookups import spectra as spectralookup
 from app.actions.lookups import quant as quantlookups 
@@ -66,7 +65,8 @@ class QuantLookupDriver(base.LookupDriver):
         super().set_options()
         self.options.update(self.define_options([
             'spectrafns', 'kronik', 'dinosaur', 'isobaric',
-            'sum_or_apex', 'rttol', 'mztol', 'mztoltype'], lookup_options))
+            'sum_or_apex', 'rttol', 'mztol', 'mztoltype', 'processes'],
+            lookup_options))
 
     def parse_input(self, **kwargs):
         super().parse_input(**kwargs)
@@ -87,14 +87,12 @@ class QuantLookupDriver(base.LookupDriver):
     def create_lookup(self):
         if self.isobaricfns:
             quantmap = openmsreader.get_quantmap(self.isobaricfns[0])
-            mzmlfn_consxml = openmsreader.mzmlfn_cons_el_generator(self.spectrafns,
-                    self.isobaricfns)
-            quantlookups.create_isobaric_quant_lookup(self.lookup, mzmlfn_consxml, 
-                    quantmap),
+            quantlookups.create_isobaric_quant_lookup(self.lookup, self.spectrafns,
+                    self.isobaricfns, quantmap, self.processes)
         if self.ms1type:
-            ms1feats = tsvreader.mzmlfn_tsvfeature_generator(self.spectrafns, self.ms1fns)
-            quantlookups.create_precursor_quant_lookup(self.lookup, ms1feats,
-                    self.sum_or_apex, self.ms1type, self.rt_tol, self.mz_tol, self.mz_toltype)
+            quantlookups.create_precursor_quant_lookup(self.lookup, self.spectrafns,
+                    self.ms1fns, self.sum_or_apex, self.ms1type, self.rt_tol,
+                    self.mz_tol, self.mz_toltype, self.processes)
 
 
 class SequenceLookupDriver(base.LookupDriver):
@@ -118,23 +116,18 @@ class SequenceLookupDriver(base.LookupDriver):
         self.options.update(self.define_options(['fn', 'outfile']))
         self.options['lookupfn'].update({'required': False, 'default': None})
         self.options.update(self.define_options(['fullprotein', 'falloff',
-            'proline', 'minlength'], lookup_options))
+            'proline', 'minlength', 'processes'], lookup_options))
         self.options.update(self.define_options(['trypsinize', 'miss_cleavage'],
             sequence_options))
 
     def create_lookup(self):
         if self.fullprotein:
-            if not self.minlength:
-                self.minlength = 7
-                # Default here since it is a param shared with many others 
-                # where it can be 0. TODO create own param for this driver
-                print('--minlen not specified, default to 7')
-            print('Creating full-length protein lookup, minimum matching '
-                    'peptide length is {}'.format(self.minlength))
-            if self.proline or self.falloff or not self.trypsinize or self.miss_cleavage:
-                print('Ignoring other options for tryptic lookup building')
-            seqlookups.create_searchspace_wholeproteins(self.lookup, self.fn,
-                                                         self.minlength)
+            print('Creating full-length protein lookup')
+            if self.proline or self.falloff or not self.trypsinize or self.miss_cleavage or self.minlength:
+                print('Ignoring other options for tryptic lookup building, '
+                      'pass --minlen to filterperco instead')
+            seqlookups.create_searchspace_wholeproteins(self.lookup, self.fn)
         else:
             seqlookups.create_searchspace(self.lookup, self.fn, self.minlength, self.proline,
-                                           self.falloff, self.trypsinize, self.miss_cleavage)
+                                           self.falloff, self.trypsinize, self.miss_cleavage,
+                                           self.processes)
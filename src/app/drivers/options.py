@@ -88,6 +88,10 @@ shared_options = {
                   'required': False, 'type': int,
                   'help': 'Field nr (first=1) in FASTA that contains gene '
                   'name when using --fastadelim to parse the gene names'},
+    'processes': {'driverattr': 'processes', 'clarg': '--processes',
+                  'type': int, 'default': 1, 'required': False,
+                  'help': 'Amount of processes to use for the steps that can '
+                  'run in parallel, default is 1'},
     'minlength': {'driverattr': 'minlength', 'default': 0,
                   'help': 'Minimum length of peptide to be included',
                   'type': int, 'clarg': '--minlen', 'required': False},
@@ -102,8 +106,10 @@ shared_options = {
                },
     'fullprotein': {'driverattr': 'fullprotein', 'clarg': '--fullprotein',
         'default': False, 'action': 'store_const', 'const': True, 'help':
-        'Store full protein sequences (at a minimum-match length) in the '
-        'SQLite file rather than tryptic sequences', 'required': False},
+        'Store full protein sequences and a suffix array over them in the '
+        'SQLite file rather than tryptic sequences. When filtering, peptides '
+        'are matched to these, use --minlen to only match peptides of a '
+        'minimum length', 'required': False},
     'minint': {'driverattr': 'minint', 'clarg': '--minint', 'type': float,
                'help': 'Intensity threshold of PSMs when calculating '
                'isobaric ratios. Values below threshold will be set to NA. '
@@ -182,6 +188,15 @@ sequence_options = {
                'help': 'Do not trypsinize. User is expected to deliver a'
                'pretrypsinized FASTA file'
                },
+    'inmemory': {'driverattr': 'inmemory', 'clarg': '--in-memory',
+                 'action': 'store_const', 'default': False, 'const': True,
+                 'help': 'Keep the target peptides to check decoys against '
+                 'in memory instead of in a lookup. Much faster for large '
+                 'FASTA files, at the cost of memory', 'required': False},
+    'seed': {'driverattr': 'seed', 'clarg': '--seed', 'type': int,
+             'required': False, 'default': None,
+             'help': 'Seed for shuffling decoy peptides, to get identical '
+             'decoys in every run'},
     'max_shuffle': {'driverattr': 'max_shuffle',
                'clarg': '--maxshuffle', 'required': False, 'type': int, 'default': 10,
                'help': 'Amount of times to attempt to shuffle a decoy reversed peptide '
@@ -301,6 +316,12 @@ percolator_options = {
                 'flag in order for the lookup to work, since sequences '
                 'will be stored and looked up reversed', 'required': False
                 },
+    'inmemory': {'driverattr': 'inmemory', 'clarg': '--in-memory',
+                 'action': 'store_const', 'default': False, 'const': True,
+                 'help': 'Load an index of the lookup sequences into memory '
+                 'before filtering, so only sequences that may be in the '
+                 'lookup are queried. Faster for large inputs, at the cost of '
+                 'loading time and memory', 'required': False},
 }
 
 psmtable_options = {
@@ -315,6 +336,20 @@ psmtable_options = {
     'oldpsmfile': {'driverattr': 'oldpsmfile', 'clarg': '--oldpsms', 'type': 'file',
                 'help': 'PSM table file containing previously analysed PSMs to '
                 'append new PSM table to.', 'required': False},
+    'fastacache': {'driverattr': 'fastacache', 'clarg': '--fastacache',
+                   'required': False, 'default': False,
+                   'help': 'Directory to cache proteins and annotation of '
+                   'FASTA files in, keyed by their md5. Runs with the same '
+                   'FASTA copy them from there instead of parsing it. '
+                   'Created when it does not exist'},
+    'mzidindex': {'driverattr': 'mzidindex', 'clarg': '--index-mzids',
+                  'action': 'store_const', 'default': False, 'const': True,
+                  'help': 'Match PSMs to their mzIdentML by spectra file, '
+                  'spectrum ID, charge and peptide instead of by order, so '
+                  'PSM tables can be filtered, sorted or concatenated. Uses '
+                  'an index file stored next to each mzIdentML, which is '
+                  'created when missing or older than the mzIdentML',
+                  'required': False},
     'filtpep': {'driverattr': 'filtpep', 'clarg': '--filtpep',
                 'help': 'Peptide q-value cutoff level as a floating point number',
                 'type': float, 'required': False},
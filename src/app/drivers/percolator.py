@@ -3,6 +3,8 @@ from app.drivers.options import percolator_options
 
 from app.actions.percolator import split
 from app.actions.percolator import filters
+from app.readers import percolator as percoreaders
+from app.writers import percolator as percowriters
 
 
 class FilterSequences(base.PercolatorDriver):
@@ -18,11 +20,25 @@ class FilterSequences(base.PercolatorDriver):
     def set_options(self):
         super().set_options()
         self.options.update(self.define_options(['fullprotein', 'deamidate', 
-            'fasta', 'minlength', 'lookupfn', 'forcetryp', 'falloff'],
+            'fasta', 'minlength', 'lookupfn', 'forcetryp', 'falloff', 'inmemory'],
             percolator_options))
 
     def set_features(self):
-        if self.fullprotein:
+        if self.fullprotein and self.lookup.has_proteome_index():
+            proteome = filters.get_proteome_index(self.lookup)
+            self.features = {
+                'peptide': filters.filter_proteome(self.allpeps, proteome,
+                                                   'pep', self.ns,
+                                                   self.deamidate,
+                                                   self.minlength,
+                                                   self.forcetryp),
+                'psm': filters.filter_proteome(self.allpsms, proteome,
+                                               'psm', self.ns,
+                                               self.deamidate,
+                                               self.minlength,
+                                               self.forcetryp),
+            }
+        elif self.fullprotein:
             self.features = {
                 'peptide': filters.filter_whole_proteins(self.allpeps,
                                                              self.fasta,
@@ -42,19 +58,31 @@ class FilterSequences(base.PercolatorDriver):
                                                          self.forcetryp)
             }
         else:
+            seqindex = False
+            if self.deamidate and not self.lookup.has_deamidated_index():
+                print('WARNING: lookup has no index on deamidated peptides, '
+                      'each D->N variant of a peptide is looked up separately. '
+                      'Create the lookup again with msstitch storeseq to add '
+                      'the index.')
+            if self.inmemory:
+                seqindex = filters.create_searchspace_index(self.lookup,
+                                                            self.falloff,
+                                                            self.deamidate)
             self.features = {
                 'peptide': filters.filter_known_searchspace(self.allpeps,
                                                                 'pep',
                                                                 self.lookup,
                                                                 self.ns,
                                                                 self.falloff,
-                                                                self.deamidate),
+                                                                self.deamidate,
+                                                                seqindex),
                 'psm': filters.filter_known_searchspace(self.allpsms,
                                                             'psm',
                                                             self.lookup,
                                                             self.ns,
                                                             self.falloff,
-                                                            self.deamidate),
+                                                            self.deamidate,
+                                                            seqindex),
             }
 
 
@@ -63,11 +91,9 @@ class SplitDriver(base.PercolatorDriver):
 
     def run(self):
         self.set_filter_types()
-        for filter_type, suffix in self.filter_types:
-            self.prepare()
-            self.set_features(filter_type)
-            self.outsuffix = suffix
-            self.write()
+        self.prepare()
+        self.set_features()
+        self.write()
 
     def set_options(self):
         """Since splitdriver splits into multiple files we cannot set an
@@ -75,15 +101,26 @@ class SplitDriver(base.PercolatorDriver):
         super().set_options()
         del(self.options['outfile'])
 
-    def set_features(self, filter_type):
-        """Calls splitter to split percolator output into target/decoy
-        elements.
-        Writes two new xml files with features. Currently only psms and
-        peptides. Proteins not here, since one cannot do protein inference
-        before having merged and remapped multifraction data anyway.
+    def prepare(self):
+        """Parses the input XML only once for all filter types"""
+        self.ns, self.static_xml = self.prepare_percolator_output(self.fn)
+        self.allfeats = percoreaders.generate_psms_peptides(self.fn, self.ns)
+
+    def set_features(self):
+        """Calls splitter to split percolator output into elements for each
+        filter type.
+        Writes a new xml file with features per filter type. Currently only
+        psms and peptides. Proteins not here, since one cannot do protein
+        inference before having merged and remapped multifraction data anyway.
         """
-        elements_to_split = {'psm': self.allpsms, 'peptide': self.allpeps}
-        self.features = self.splitfunc(elements_to_split, self.ns, filter_type)
+        self.features = self.splitfunc(self.allfeats, self.ns,
+                                       [ft for ft, _ in self.filter_types])
+
+    def write(self):
+        outfns = [self.create_outfilepath(self.fn, suffix)
+                  for _, suffix in self.filter_types]
+        percowriters.write_split_percolator_xml(self.static_xml,
+                                                self.features, outfns)
 
 
 class SplitProteinDriver(SplitDriver):
@@ -103,9 +140,9 @@ class SplitProteinDriver(SplitDriver):
             i=ix, dig=maxdigits))
             for ix, headers in enumerate(self.protheaders)]
 
-    def set_features(self, filter_type):
+    def set_features(self):
         self.splitfunc = split.split_protein_header_id_type
-        super().set_features(filter_type)
+        super().set_features()
 
     def set_options(self):
         super().set_options()
@@ -2,13 +2,13 @@ import os
 import sys
 from hashlib import md5
 from itertools import chain
+from functools import partial
+from multiprocessing import Pool
 
 from app.drivers.options import psmtable_options
 from app.drivers.base import PSMDriver
 
 from app.readers import tsv as tsvreader
-from app.readers import mzidplus as mzidreader
-from app.dataformats import mzidtsv as psmhead
 from app.dataformats.prottable import HEADER_NO_FULLQ_PSMS
 
 from app.actions.psmtable import splitmerge as splitmerge
@@ -85,7 +85,7 @@ class Perco2PSMDriver(PSMDriver):
     def set_options(self):
         super().set_options()
         self.options.update(self.define_options(['multifiles', 'mzidfns', 'percofn',
-            'filtpep', 'filtpsm'], psmtable_options))
+            'filtpep', 'filtpsm', 'processes', 'mzidindex'], psmtable_options))
 
     def prepare(self):
         # multiple PSM tables passed so do not read here, match with mzid
@@ -95,22 +95,19 @@ class Perco2PSMDriver(PSMDriver):
         self.percopsms = perco.calculate_target_decoy_competition(self.percofn)
                 
     def write(self):
-        for psmfn, mzidfn in zip(self.fn, self.mzidfns):
-            oldheader = tsvreader.get_tsv_header(psmfn)
-            header = perco.get_header_with_percolator(oldheader)
-            outfn = self.create_outfilepath(psmfn, self.outsuffix)
-            mzns = mzidreader.get_mzid_namespace(mzidfn)
-            mzidsr = mzidreader.mzid_spec_result_generator(mzidfn, mzns)
-            psms = tsvreader.generate_split_tsv_lines(psmfn, oldheader)
-            psms_perco = perco.add_fdr_to_mzidtsv(psms, mzidsr, mzns,
-                    self.percopsms)
-            if self.filtpsm:
-                psms_perco = filtering.filter_psms_conf(psms_perco, psmhead.HEADER_PSMQ,
-                        self.filtpsm, True)
-            if self.filtpep:
-                psms_perco = filtering.filter_psms_conf(psms_perco, psmhead.HEADER_PEPTIDE_Q,
-                        self.filtpep, True)
-            writer.write_tsv(header, psms_perco, outfn)
+        jobs = [(psmfn, mzidfn, self.create_outfilepath(psmfn, self.outsuffix))
+                for psmfn, mzidfn in zip(self.fn, self.mzidfns)]
+        write_job = partial(perco.write_percolator_psmtable, filtpsm=self.filtpsm,
+                            filtpep=self.filtpep, mzidindex=self.mzidindex)
+        if self.processes > 1:
+            # Workers get the q-value data once at startup, which is inherited
+            # instead of pickled when forking, rather than with each job
+            with Pool(self.processes, initializer=perco.set_worker_percodata,
+                      initargs=(self.percopsms,)) as pool:
+                pool.map(write_job, jobs)
+        else:
+            for job in jobs:
+                write_job(job, percodata=self.percopsms)
 
 
 class ConfidenceFilterDriver(PSMDriver):
@@ -156,7 +153,8 @@ class PSMTableRefineDriver(PSMDriver):
         super().set_options()
         options = self.define_options(['oldpsmfile', 'lookupfn', 'precursor', 'isobaric',
             'unroll', 'spectracol', 'addbioset', 'addmiscleav', 'genes',
-            'proteingroup', 'fasta', 'genefield', 'fastadelim'], psmtable_options)
+            'proteingroup', 'fasta', 'genefield', 'fastadelim', 'fastacache'],
+            psmtable_options)
         self.options.update(options)
 
     def set_features(self):
@@ -202,7 +200,8 @@ class PSMTableRefineDriver(PSMDriver):
         # having passed an oldpsmfile (because of oldfasta_md5):
         if not self.oldpsmfile:
             proteins = refine.store_proteins_descriptions(self.lookup, self.fasta,
-                    fasta_md5, self.fn, self.oldheader, fastadelim, genefield)
+                    fasta_md5, self.fn, self.oldheader, fastadelim, genefield,
+                    self.fastacache)
 
         refine.create_psm_lookup(self.fn, self.oldheader, proteins, self.lookup, 
                 shiftrows, self.unroll, specfncol, fastadelim, genefield)
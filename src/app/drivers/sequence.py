@@ -1,8 +1,9 @@
 from app.drivers import base
 from app.actions import sequence
 from app.actions.lookups import sequence as seqlup
+from app.readers import fasta as fastareader
+from app.writers import fasta as fastawriter
 from app.drivers.options import lookup_options, sequence_options
-from Bio import SeqIO
 
 
 class DecoySeqDriver(base.BaseDriver):
@@ -23,17 +24,24 @@ class DecoySeqDriver(base.BaseDriver):
         super().set_options()
         self.options.update(self.define_options([
             'fn', 'outfile', 'lookupfn', 'scramble', 'ignoretarget', 'trypsinize', 
-            'miss_cleavage', 'minlength', 'max_shuffle'], sequence_options))
+            'miss_cleavage', 'minlength', 'max_shuffle', 'inmemory', 'seed',
+            'processes'], sequence_options))
         self.options['lookupfn'].update({'required': False, 'default': None})
 
     def run(self):
         outfn = self.create_outfilepath(self.fn, self.outsuffix)
-        if self.lookup is None and not self.ignoretarget:
-            self.initialize_lookup('decoychecker.sqlite')
-            seqlup.create_searchspace(self.lookup, self.fn, self.minlength, reverse_seqs=False, miss_cleavage=self.miss_cleavage)
-        decoyfa = sequence.create_decoy_fa(self.fn, self.scramble, self.lookup, self.trypsinize, self.miss_cleavage, self.minlength, self.max_shuffle)
-        with open(outfn, 'w') as fp:
-            SeqIO.write(decoyfa, fp, 'fasta')
+        if self.inmemory and self.lookup is not None:
+            targets = seqlup.get_searchspace_set(self.lookup)
+        elif self.inmemory and not self.ignoretarget:
+            targets = seqlup.create_searchspace_set(self.fn, self.minlength, self.miss_cleavage)
+        else:
+            if self.lookup is None and not self.ignoretarget:
+                self.initialize_lookup('decoychecker.sqlite')
+                seqlup.create_searchspace(self.lookup, self.fn, self.minlength, reverse_seqs=False, miss_cleavage=self.miss_cleavage)
+            targets = self.lookup
+        decoyfa = sequence.create_decoy_fa(self.fn, self.scramble, targets, self.trypsinize, self.miss_cleavage, self.minlength, self.max_shuffle,
+                                           self.seed, self.processes)
+        fastawriter.write_fasta(decoyfa, outfn)
 
 
 class TrypsinizeDriver(base.BaseDriver):
@@ -48,11 +56,12 @@ class TrypsinizeDriver(base.BaseDriver):
     def set_options(self):
         super().set_options()
         self.options.update(self.define_options([
-            'fn', 'outfile', 'miss_cleavage', 'minlength', 'proline'], sequence_options))
+            'fn', 'outfile', 'miss_cleavage', 'minlength', 'proline', 'processes'],
+            sequence_options))
 
     def run(self):
         outfn = self.create_outfilepath(self.fn, self.outsuffix)
-        with open(self.fn) as fp, open(outfn, 'w') as wfp:
-            seqs = SeqIO.parse(fp, 'fasta')
-            decoyfa = sequence.create_trypsinized(seqs, self.proline, self.miss_cleavage, self.minlength)
-            SeqIO.write(decoyfa, wfp, 'fasta')
+        seqs = fastareader.generate_fasta_records(self.fn)
+        peptides = sequence.create_trypsinized(seqs, self.proline, self.miss_cleavage,
+                                               self.minlength, self.processes)
+        fastawriter.write_fasta(peptides, outfn)
@@ -1,5 +1,5 @@
 from app.lookups.sqlite import (quant, searchspace, biosets, spectra, 
-        prottable, psms, peptable)
+        prottable, psms, peptable, mzidindex)
 
 
 def get_lookup(fn, lookuptype):
@@ -13,6 +13,7 @@ def get_lookup(fn, lookuptype):
                  'prottable': prottable.ProtTableDB,
                  'genetable': prottable.GeneTableDB,
                  'associdtable': prottable.GeneTableAssocIDsDB,
+                 'mzidindex': mzidindex.MzidIndexDB,
                  }
     return lookupmap[lookuptype](fn)
 
@@ -345,6 +345,13 @@ mslookup_tables = {'biosets': ['set_id INTEGER PRIMARY KEY',
                    'known_searchspace': ['seqs TEXT UNIQUE'],
                    'protein_peptides': ['seq TEXT', 'protid TEXT',
                                         'pos INTEGER'],
+                   'proteome_proteins': ['protid TEXT', 'start INTEGER'],
+                   'proteome_index': ['chunk_id INTEGER PRIMARY KEY',
+                                      'sequence BLOB', 'suffix_array BLOB'],
+                   'mzid_psms': ['specfile TEXT', 'spectrum_id TEXT',
+                                 'charge TEXT', 'peptide TEXT',
+                                 'scanindex TEXT', 'rank TEXT',
+                                 'scan INTEGER'],
                    }
 
 
@@ -0,0 +1,23 @@
+from app.lookups.sqlite.base import DatabaseConnection
+
+
+class MzidIndexDB(DatabaseConnection):
+    def add_tables(self, tabletypes):
+        self.create_tables(['mzid_psms'])
+
+    def store_psms(self, psms):
+        self.store_many(
+            'INSERT INTO mzid_psms(specfile, spectrum_id, charge, peptide, '
+            'scanindex, rank, scan) VALUES (?, ?, ?, ?, ?, ?, ?)', psms)
+
+    def index_psms(self):
+        self.index_column('mzid_psm_index', 'mzid_psms',
+                          'spectrum_id, charge, peptide, specfile')
+
+    def get_psm(self, specfile, spectrum_id, charge, peptide):
+        """Returns scan index, rank and scan number of a PSM, or None"""
+        cursor = self.get_cursor()
+        cursor.execute('SELECT scanindex, rank, scan FROM mzid_psms WHERE '
+                       'spectrum_id=? AND charge=? AND peptide=? AND '
+                       'specfile=?', (spectrum_id, charge, peptide, specfile))
+        return cursor.fetchone()
@@ -1,4 +1,4 @@
-from app.lookups.sqlite.base import ResultLookupInterface
+from app.lookups.sqlite.base import ResultLookupInterface, mslookup_tables
 
 
 # Indices that belong to positions of these features in output from
@@ -10,6 +10,10 @@ PSM_COUNT_INDEX = 4
 PROTEIN_SCORE_INDEX = 5
 COVERAGE_INDEX = 6
 EVIDENCE_LVL_INDEX = 7
+# Tables with proteins and annotation from a FASTA file, in order of foreign
+# keys, that are stored in a FASTA cache
+FASTA_TABLES = ['proteins', 'protein_evidence', 'protein_seq', 'prot_desc',
+                'genes', 'ensg_proteins', 'associated_ids', 'genename_proteins']
 
 
 class PSMDB(ResultLookupInterface):
@@ -69,6 +73,38 @@ class PSMDB(ResultLookupInterface):
         self.index_column('gp_p_ix', 'genename_proteins', 'pacc_id')
         self.index_column('gp_gn_ix', 'genename_proteins', 'gn_id')
 
+    def store_fasta_from_cache(self, fn, md5, cachefn):
+        """Copies proteins and annotation of a FASTA file from a cache made
+        by write_fasta_cache, instead of storing them from the FASTA"""
+        cursor = self.get_cursor()
+        cursor.execute('INSERT INTO fastafn(filename, md5) VALUES(?, ?)',
+                (fn, md5))
+        self.conn.commit()
+        cursor.execute('ATTACH DATABASE ? AS fastacache', (cachefn,))
+        for table in FASTA_TABLES:
+            cursor.execute('INSERT INTO main.{0} SELECT * FROM fastacache.{0}'.format(table))
+        self.conn.commit()
+        cursor.execute('DETACH DATABASE fastacache')
+        self.index_column('proteins_index', 'proteins', 'protein_acc')
+        self.index_column('evidence_index', 'protein_evidence', 'protein_acc')
+        self.index_column('protdesc_index', 'prot_desc', 'pacc_id')
+        self.index_column('ensg_p_ix', 'ensg_proteins', 'pacc_id')
+        self.index_column('ensg_ensg_ix', 'ensg_proteins', 'gene_id')
+        self.index_column('gp_p_ix', 'genename_proteins', 'pacc_id')
+        self.index_column('gp_gn_ix', 'genename_proteins', 'gn_id')
+
+    def write_fasta_cache(self, cachefn):
+        """Writes the stored proteins and annotation of a FASTA file to a new
+        cache file, for other lookups to copy"""
+        cursor = self.get_cursor()
+        cursor.execute('ATTACH DATABASE ? AS fastacache', (cachefn,))
+        for table in FASTA_TABLES:
+            cursor.execute('CREATE TABLE fastacache.{0}({1})'.format(
+                table, ', '.join(mslookup_tables[table])))
+            cursor.execute('INSERT INTO fastacache.{0} SELECT * FROM main.{0}'.format(table))
+        self.conn.commit()
+        cursor.execute('DETACH DATABASE fastacache')
+
     def store_proteins(self, proteins, evidence_lvls=False, sequences=False):
         cursor = self.get_cursor()
         cursor.executemany(
@@ -324,31 +360,31 @@ class PSMDB(ResultLookupInterface):
         cursor = self.get_cursor()
         return cursor.execute(sql)
 
-    def select_all_psm_quants(self, shiftrows, isobaric=False, precursor=False):
-        selects = ['pr.rownr']
-        joins = ['JOIN psms USING(psm_id)', 'JOIN mzml USING(spectra_id)']
-        sqlfields, fieldcount = {}, 1
-        if isobaric:
-            selects.extend(['ic.channel_name', 'iq.intensity'])
-            joins.extend(['JOIN isobaric_quant AS iq USING(spectra_id)',
-                          'JOIN isobaric_channels AS ic USING(channel_id)'])
-            sqlfields['isochan'] = fieldcount
-            sqlfields['isoquant'] = fieldcount + 1
-            fieldcount += 2
-        if precursor:
-            selects.extend(['pq.intensity', 'pfw.fwhm'])
-            joins.extend(['LEFT OUTER JOIN ms1_align USING(spectra_id)',
-                          'LEFT OUTER JOIN ms1_quant AS pq USING(feature_id)',
-                          'LEFT OUTER JOIN ms1_fwhm AS pfw USING(feature_id)',
-                          ])
-            sqlfields['precursor'] = fieldcount
-            sqlfields['fwhm'] = fieldcount + 1
-
-        rowlim = 'WHERE pr.rownr>{} '.format(shiftrows - 1) if shiftrows else ''
-        sql = ('SELECT {} FROM psmrows as pr {} {} '
-               'ORDER BY pr.rownr'.format(', '.join(selects), ' '.join(joins), rowlim))
+    def get_isobaric_quant_rows(self, shiftrows):
+        """Returns cursor of rownr, channel id, intensity, in no particular
+        order, for the PSM rows from shiftrows"""
+        cursor = self.get_cursor()
+        return cursor.execute(
+            'SELECT pr.rownr, iq.channel_id, iq.intensity FROM psmrows AS pr '
+            'JOIN psms USING(psm_id) '
+            'JOIN isobaric_quant AS iq USING(spectra_id) '
+            'WHERE pr.rownr>=?', (shiftrows,))
+
+    def get_precursor_quant_rows(self, shiftrows):
+        """Returns cursor of rownr, precursor intensity, FWHM, in no particular
+        order, for the PSM rows from shiftrows that have precursor quant"""
+        cursor = self.get_cursor()
+        return cursor.execute(
+            'SELECT pr.rownr, pq.intensity, pfw.fwhm FROM psmrows AS pr '
+            'JOIN psms USING(psm_id) '
+            'JOIN ms1_align USING(spectra_id) '
+            'JOIN ms1_quant AS pq USING(feature_id) '
+            'LEFT OUTER JOIN ms1_fwhm AS pfw USING(feature_id) '
+            'WHERE pr.rownr>=?', (shiftrows,))
+
+    def get_isobaric_channel_ids(self):
         cursor = self.get_cursor()
-        return cursor.execute(sql), sqlfields
+        return cursor.execute('SELECT channel_id, channel_name FROM isobaric_channels')
 
     def get_all_quantmaps(self):
         """Returns all unique quant channels from lookup as list"""
@@ -9,13 +9,6 @@ class QuantDB(ResultLookupInterface):
         if 'ms1' in tabletypes:
             self.create_tables(['ms1_quant', 'ms1_align', 'ms1_fwhm'])
 
-    def get_fnfeats(self, fn_id):
-        cursor = self.get_cursor()
-        return cursor.execute(
-            'SELECT mz, feature_id, charge, retention_time '
-            'FROM ms1_quant '
-            'WHERE mzmlfile_id=? ORDER BY mz', (fn_id,))
-
     def store_channelmap(self, channels):
         self.store_many(
             'INSERT OR IGNORE INTO isobaric_channels(channel_name) VALUES(?)', channels)
@@ -29,32 +22,30 @@ class QuantDB(ResultLookupInterface):
         self.index_column('spectraid_index', 'isobaric_quant', 'spectra_id')
         self.index_column('channel_id_index', 'isobaric_quant', 'channel_id')
 
-    def get_specmap(self, fn_id, retention_time=False, scan_nr=False):
-        """Returns all spectra ids for spectra filename, keyed by 
-        retention time"""
-        cursor = self.get_cursor()
-        values = [fn_id]
-        if retention_time:
-            sql = 'SELECT retention_time,spectra_id FROM mzml WHERE mzmlfile_id=? '
-        elif scan_nr:
-            sql = 'SELECT scan_nr,spectra_id FROM mzml WHERE mzmlfile_id=? '
-        cursor.execute(sql, tuple(values))
-        return {k: sid for k,sid in cursor.fetchall()}
+    def get_fnspectra_rt_sorted(self, fn_id):
+        """Returns list of retention time, spectra id for the spectra of an
+        mzML file, sorted on retention time"""
+        return self.get_cursor().execute(
+            'SELECT retention_time, spectra_id FROM mzml WHERE mzmlfile_id=? '
+            'ORDER BY retention_time', (fn_id,)).fetchall()
 
     def get_channelmap(self):
         cursor = self.get_cursor()
         cursor.execute('SELECT channel_id, channel_name FROM isobaric_channels')
         return cursor
 
+    def get_highest_feature_id(self):
+        cursor = self.get_cursor()
+        cursor.execute('SELECT MAX(feature_id) FROM ms1_quant')
+        maxid = cursor.fetchone()[0]
+        return maxid if maxid is not None else 0
+
     def store_ms1_quants(self, quants):
-        # Return feat IDs?
-        quants = self.store_many_return_id(
-            'INSERT INTO ms1_quant(mzmlfile_id, retention_time, mz, '
-            'charge, intensity) VALUES (?, ?, ?, ?, ?)', quants)
-        return quants
+        self.store_many(
+            'INSERT INTO ms1_quant(feature_id, mzmlfile_id, retention_time, mz, '
+            'charge, intensity) VALUES (?, ?, ?, ?, ?, ?)', quants)
 
     def store_fwhm(self, quants):
-        # FIXME get feature_id for all passed quants, possibly directly when storing them
         self.store_many('INSERT INTO ms1_fwhm(feature_id, fwhm) VALUES (?, ?)', quants)
 
     def store_ms1_alignments(self, aligns):
@@ -73,7 +64,8 @@ class QuantDB(ResultLookupInterface):
         self.index_column('ms1al_feat_ix', 'ms1_align', 'feature_id')
         self.index_column('ms1al_spec_ix', 'ms1_align', 'spectra_id')
 
-    def get_spectra_mz_sorted(self):
+    def get_fnspectra_mz_sorted(self, fn_id):
+        """Returns list of spectra of an mzML file, sorted on mz"""
         return self.get_cursor().execute(
-            'SELECT spectra_id, mzmlfile_id, charge, mz, retention_time '
-            'FROM mzml ORDER BY mzmlfile_id,mz')
+            'SELECT spectra_id, charge, mz, retention_time '
+            'FROM mzml WHERE mzmlfile_id=? ORDER BY mz', (fn_id,)).fetchall()
@@ -1,10 +1,21 @@
+import sqlite3
+
 from app.lookups.sqlite.base import DatabaseConnection
 
+DEAMIDATED_SEQS = "REPLACE(seqs, 'D', 'N')"
+
+
+def is_deamidated_variant(seq, variant):
+    """True if variant is seq with zero or more of its D exchanged for N"""
+    return all(aa == var_aa or (aa == 'D' and var_aa == 'N')
+               for aa, var_aa in zip(seq, variant))
+
 
 class SearchSpaceDB(DatabaseConnection):
     def add_tables(self, tabletypes):
         """Creates a searchspace lookup sqlite."""
-        self.create_tables(['known_searchspace', 'protein_peptides'])
+        self.create_tables(['known_searchspace', 'proteome_proteins',
+                            'proteome_index'])
 
     def write_peps(self, peps, reverse_seqs):
         """Writes peps to db. We can reverse to be able to look up
@@ -25,16 +36,33 @@ class SearchSpaceDB(DatabaseConnection):
         else:
             self.index_column('sequence_index', 'known_searchspace',
                               'seqs', unique=True)
+        self.index_deamidated_peps()
 
-    def store_pep_proteins(self, pepproteins):
+    def store_proteome(self, proteins, chunks):
+        """Stores the proteins (protid, start position) in a concatenated
+        proteome, and the proteome sequence and its suffix array in chunks
+        of (chunk_id, sequence, suffix array) with equal amount of elements"""
         cursor = self.get_cursor()
-        cursor.executemany('INSERT INTO protein_peptides(seq, protid, pos) '
-                           'VALUES(?, ?, ?)', pepproteins)
+        cursor.executemany('INSERT INTO proteome_proteins(protid, start) '
+                           'VALUES(?, ?)', proteins)
+        cursor.executemany('INSERT INTO proteome_index(chunk_id, sequence, '
+                           'suffix_array) VALUES(?, ?, ?)', chunks)
         self.conn.commit()
 
-    def index_proteins(self):
-        self.index_column('pepix', 'protein_peptides', 'seq')
-        self.conn.commit()
+    def has_proteome_index(self):
+        """Lookups created before the proteome index have a protein_peptides
+        table instead"""
+        cursor = self.get_cursor()
+        try:
+            cursor.execute('SELECT EXISTS(SELECT chunk_id FROM proteome_index)')
+        except sqlite3.OperationalError:
+            return False
+        return cursor.fetchone()[0] == 1
+
+    def get_proteome_chunks(self):
+        cursor = self.get_cursor()
+        return cursor.execute('SELECT sequence, suffix_array FROM proteome_index '
+                              'ORDER BY chunk_id')
 
     def get_multi_seq(self, allseqs):
         cursor = self.get_cursor()
@@ -47,30 +75,69 @@ class SearchSpaceDB(DatabaseConnection):
             [allseqs_found.add(x[0]) for x in cursor.execute(sql, seqs)]
         return allseqs_found
 
-    def check_seq_exists(self, seq, amount_ntermwildcards):
+    def get_all_seqs(self):
+        cursor = self.get_cursor()
+        return cursor.execute('SELECT seqs FROM known_searchspace')
+
+    def index_deamidated_peps(self):
+        """Indexes sequences with D exchanged for N, so all deamidated
+        variants of a peptide can be looked up at once"""
+        self.index_column('deamidated_index', 'known_searchspace',
+                          DEAMIDATED_SEQS)
+
+    def has_deamidated_index(self):
+        """Lookups created before storeseq indexed deamidated sequences do
+        not have the deamidated_index"""
+        cursor = self.get_cursor()
+        cursor.execute("SELECT EXISTS(SELECT name FROM sqlite_master WHERE "
+                       "type='index' AND name='deamidated_index')")
+        return cursor.fetchone()[0] == 1
+
+    def check_seq_exists(self, seq, amount_ntermwildcards, deamidation=False):
         """Look up sequence in sqlite DB. Returns True or False if it
         exists (or not). When looking up a reversed DB with
         ntermwildcards: we reverse the sequence of the pep and add
-        a LIKE and %-suffix to the query.
+        a LIKE and %-suffix to the query. With deamidation, the sequence
+        also exists when a variant with any of its D exchanged for N exists.
         """
+        if deamidation:
+            return self.check_deamidated_seq_exists(seq, amount_ntermwildcards)
         cursor = self.get_cursor()
         if amount_ntermwildcards > 0:
+            # Reversed sequences starting with the reversed seq, which are
+            # at most amount_ntermwildcards longer than seq, found by a
+            # range search on the unique index of the sequences
             seq = seq[::-1]
-            sqlseq = '{}{}'.format(seq, '%')
-            # FIXME non-parametrized string binding because if ? binding is
-            # used the INDEX is not used when looking up, apparently because
-            # the query cant be optimized when using LIKE and binding.
-            sql = ('select seqs from known_searchspace where seqs LIKE '
-                   '"{}"'.format(sqlseq))
-            for match in cursor.execute(sql):
-                if match[0][:-amount_ntermwildcards] in seq:
-                    return True
-            return False
+            upper = '{}{}'.format(seq[:-1], chr(ord(seq[-1]) + 1))
+            sql = ('SELECT EXISTS(SELECT seqs FROM known_searchspace WHERE '
+                   'seqs >= ? AND seqs < ? AND LENGTH(seqs) <= ? LIMIT 1)')
+            return cursor.execute(sql, (seq, upper, len(seq) +
+                                        amount_ntermwildcards)).fetchone()[0] == 1
         else:
             sql = ('select exists(select seqs from known_searchspace '
                    'where seqs=? limit 1)')
             return cursor.execute(sql, (seq, )).fetchone()[0] == 1
 
+    def check_deamidated_seq_exists(self, seq, amount_ntermwildcards):
+        """Looks up all stored sequences that are equal to seq when D is
+        exchanged for N in both (using the deamidated_index), and checks if
+        one of them is a D->N variant of seq"""
+        cursor = self.get_cursor()
+        if amount_ntermwildcards > 0:
+            # Reversed sequences starting with the reversed seq, which are
+            # at most amount_ntermwildcards longer than seq
+            seq = seq[::-1]
+            canonical = seq.replace('D', 'N')
+            sql = ('SELECT seqs FROM known_searchspace WHERE {0} >= ? AND '
+                   '{0} < ?'.format(DEAMIDATED_SEQS))
+            upper = '{}{}'.format(canonical[:-1], chr(ord(canonical[-1]) + 1))
+            matches = (match[:len(seq)] for match, in cursor.execute(
+                sql, (canonical, upper)) if len(match) - amount_ntermwildcards <= len(seq))
+        else:
+            sql = 'SELECT seqs FROM known_searchspace WHERE {} = ?'.format(DEAMIDATED_SEQS)
+            matches = (match for match, in cursor.execute(sql, (seq.replace('D', 'N'),)))
+        return any(is_deamidated_variant(seq, match) for match in matches)
+
     def get_protein_from_pep(self, peptide):
         cursor = self.get_cursor()
         cursor.execute('SELECT protid, pos FROM protein_peptides WHERE seq='
@@ -1,4 +1,5 @@
-from Bio import SeqIO
+import mmap
+import os
 
 
 def get_proteins_for_db(fastafn, fastadelim, genefield):
@@ -6,36 +7,70 @@ def get_proteins_for_db(fastafn, fastadelim, genefield):
     and evidence levels for storage in lookup DB. Duplicate accessions in
     fasta are accepted and removed by keeping only the last one.
     """
-    records = {acc: (rec, get_record_type(rec)) for acc, rec in 
-            SeqIO.index(fastafn, 'fasta').items()}
+    records = {acc: (seq, get_header_fields(acc, header, fastadelim, genefield))
+               for acc, header, seq in generate_fasta_records(fastafn)}
     proteins = ((x,) for x in records.keys())
-    sequences = ((acc, str(rec.seq)) for acc, (rec, rtype) in records.items())
-    desc = ((acc, get_description(rec, rtype)) for acc, (rec, rtype) in records.items() if rtype)
-    evid = ((acc, get_uniprot_evidence_level(rec, rtype)) for acc, (rec, rtype) in 
-        records.items())
-    ensgs = [(get_ensg(rec), acc) for acc, (rec, rtype) in records.items()
-            if rtype == 'ensembl']
-    def sym_out():
-        symbols = ((get_symbol(rec, rtype, fastadelim, genefield), acc) for 
-                acc, (rec, rtype) in records.items() if rtype)
-        othergene = ((get_other_gene(rec, fastadelim, genefield), acc) for acc, (rec, rtype) in records.items()
-                if not rtype and fastadelim and fastadelim in rec.description)
-        yield from symbols
-        yield from othergene
-    return proteins, sequences, desc, evid, ensgs, [x for x in sym_out()]
-
-
-def parse_fasta(fn):
-    with open(fn) as fp:
-        for record in SeqIO.parse(fp, 'fasta'):
-            yield record
-
-
-def get_record_type(record):
-    dmod = get_decoy_mod_string(record.id)
-    test_name = record.id
+    sequences = ((acc, seq) for acc, (seq, fields) in records.items())
+    desc = ((acc, fields[1]) for acc, (seq, fields) in records.items() if fields[0])
+    evid = ((acc, fields[2]) for acc, (seq, fields) in records.items())
+    ensgs = [(check_ensg(fields[3]), acc) for acc, (seq, fields) in records.items()
+             if fields[0] == 'ensembl']
+    symbols = [(fields[4], acc) for acc, (seq, fields) in records.items() if fields[0]]
+    othergenes = [(fields[4], acc) for acc, (seq, fields) in records.items()
+                  if not fields[0] and fields[4] is not None]
+    return proteins, sequences, desc, evid, ensgs, symbols + othergenes
+
+
+def generate_fasta_records(fn):
+    """Yields (accession, header, sequence) of the records in a FASTA file,
+    which is memory mapped and sliced into records without creating
+    Biopython objects"""
+    if not os.path.getsize(fn):
+        return
+    with open(fn, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as fa:
+        # Text before the first record is skipped
+        start = 0 if fa[:1] == b'>' else fa.find(b'\n>') + 1 or len(fa)
+        while start < len(fa):
+            headerend = fa.find(b'\n', start)
+            if headerend == -1:
+                headerend = len(fa)
+            end = fa.find(b'\n>', headerend)
+            end = len(fa) if end == -1 else end + 1
+            header = fa[start + 1:headerend].decode().rstrip()
+            seq = fa[headerend:end].translate(None, b' \t\r\n').decode()
+            yield header.split(None, 1)[0] if header else '', header, seq
+            start = end
+
+
+def get_header_fields(acc, header, fastadelim, genefield):
+    """Parses a FASTA header once into its protein type, description,
+    evidence level, gene (ENSG, only for ENSEMBL) and symbol. Symbol is None
+    when the header has no type and either does not contain fastadelim or
+    no genefield is passed"""
+    rtype = get_record_type(acc)
+    words = header.split()
+    ensg = None
+    if rtype == 'ensembl':
+        fields = [x.split(':') for x in words]
+        desc = get_ensembl_description(words, fields)
+        ensg = get_field_value(fields, 'gene', None)
+        symbol = get_field_value(fields, 'gene_symbol')
+    elif rtype == 'swiss':
+        fields = [x.split('=') for x in words]
+        desc = get_swiss_description(words)
+        symbol = get_field_value(fields, 'GN')
+    else:
+        desc = None
+        symbol = get_other_gene(header, fastadelim, genefield) if (
+                fastadelim and fastadelim in header and genefield is not None) else None
+    return rtype, desc, get_evidence_level(words, rtype), ensg, symbol
+
+
+def get_record_type(acc):
+    dmod = get_decoy_mod_string(acc)
+    test_name = acc
     if dmod is not None:
-        test_name = record.id.replace(dmod, '')
+        test_name = acc.replace(dmod, '')
     if test_name.split('|')[0] in ['sp', 'tr']:
         return 'swiss'
     elif test_name[:3] == 'ENS':
@@ -58,74 +93,60 @@ def get_decoy_mod_string(protein):
                 return mod
 
 
-def get_description(record, rectype):
-    if rectype == 'ensembl':
-        desc_spl = [x.split(':') for x in record.description.split()]
-        try:
-            descix = [ix for ix, x in enumerate(desc_spl) if x[0] == 'description'][0]
-        except IndexError:
-            return 'NA'
-        desc = ' '.join([':'.join(x) for x in desc_spl[descix:]])[12:]
-        return desc
-    elif rectype == 'swiss':
-        desc = []
-        for part in record.description.split()[1:]:
-            if len(part.split('=')) > 1:
-                break
-            desc.append(part)
-        return ' '.join(desc)
+def get_ensembl_description(words, fields):
+    try:
+        descix = [ix for ix, x in enumerate(fields) if x[0] == 'description'][0]
+    except IndexError:
+        return 'NA'
+    return ' '.join(words[descix:])[12:]
+
 
+def get_swiss_description(words):
+    desc = []
+    for part in words[1:]:
+        if '=' in part:
+            break
+        desc.append(part)
+    return ' '.join(desc)
 
-def get_other_gene(record, fastadelim, genefield):
-    return record.description.split(fastadelim)[genefield]
+
+def get_other_gene(header, fastadelim, genefield):
+    return header.split(fastadelim)[genefield]
 
 
 def get_genes_pickfdr(fastafn, outputtype, fastadelim, genefield):
     """Called by protein FDR module for both ENSG and e.g. Uniprot"""
-    for rec in parse_fasta(fastafn):
-        rtype = get_record_type(rec)
+    for acc, header, seq in generate_fasta_records(fastafn):
+        rtype, desc, evid, ensg, symbol = get_header_fields(acc, header,
+                                                            fastadelim, genefield)
         if rtype == 'ensembl' and outputtype == 'ensg':
-            yield get_ensg(rec)
+            yield check_ensg(ensg)
         elif outputtype == 'genename':
-            yield get_symbol(rec, rtype, fastadelim, genefield)
+            # Headers without type only have a symbol when passing genefield
+            yield symbol if rtype or (symbol is not None and genefield) else 'NA'
 
 
-def get_ensg(record):
-    fields = [x.split(':') for x in record.description.split()]
-    try:
-        return [x[1] for x in fields if x[0] == 'gene' and len(x) == 2][0]
-    except IndexError:
+def check_ensg(ensg):
+    if ensg is None:
         raise RuntimeError('ENSEMBL detected but cannot find gene ENSG in fasta')
+    return ensg
 
 
-def get_symbol(record, rectype, fastadelim, genefield):
-    if rectype == 'ensembl':
-        fields = [x.split(':') for x in record.description.split()]
-        sym = [x[1] for x in fields if x[0] == 'gene_symbol' and len(x) == 2]
-    elif rectype == 'swiss':
-        fields = [x.split('=') for x in record.description.split()]
-        sym = [x[1] for x in fields if x[0] == 'GN' and len(x) == 2]
-    elif fastadelim and fastadelim in record.description and genefield:
-        return record.description.split(fastadelim)[genefield]
-    else:
-        return 'NA'
+def get_field_value(fields, key, default='NA'):
     try:
-        return sym[0]
+        return [x[1] for x in fields if x[0] == key and len(x) == 2][0]
     except IndexError:
-        return 'NA'
+        return default
 
 
-def get_uniprot_evidence_level(record, rtype):
+def get_evidence_level(words, rtype):
     """Returns uniprot protein existence evidence level for a fasta header.
     Evidence levels are 1-5, but we return 5 - x since sorting still demands
     that higher is better."""
     if rtype != 'swiss':
         return -1
-    for item in record.description.split():
+    for item in words:
         item = item.split('=')
-        try:
-            if item[0] == 'PE' and len(item) == 2:
-                return 5 - int(item[1])
-        except IndexError:
-            continue
+        if item[0] == 'PE' and len(item) == 2:
+            return 5 - int(item[1])
     return -1
@@ -2,6 +2,13 @@
 
 from app.readers import xml as basereader
 
+SPECDATA_IGNORE_TAGS = ['cvList',
+                        'AnalysisSoftwareList',
+                        'SequenceCollection',
+                        'AnalysisProtocolCollection',
+                        'AnalysisCollection',
+                        ]
+
 def get_mzid_namespace(mzidfile):
     return basereader.get_namespace_from_top(mzidfile, None)
 
@@ -32,16 +39,29 @@ def generate_mzid_peptides(mzidfile, namespace):
         namespace)
 
 
+def generate_mzid_psm_elements(mzidfile, namespace):
+    """Single pass over spectra data, peptides and spectrum identification
+    results of an mzIdentML, yields (tag, element) in file order, which
+    has all SpectraData and Peptide elements before the results"""
+    return basereader.generate_xmltags_multiple(
+        mzidfile,
+        ['SpectraData', 'Peptide', 'SpectrumIdentificationResult'],
+        ['cvList',
+         'AnalysisSoftwareList',
+         'DBSequence',
+         'PeptideEvidence',
+         'AnalysisProtocolCollection',
+         'AnalysisCollection',
+         ],
+        namespace)
+
+
 def get_mzid_peptidedata(peptide, xmlns):
     pep_id = peptide.attrib['id']
     sequence = peptide.find('{}PeptideSequence'.format(xmlns)).text
     mods = {}
     for mod in peptide.findall('{}Modification'.format(xmlns)):
-        modweight = round(float(mod.attrib['monoisotopicMassDelta']), 3)
-        if modweight > 0:
-            modweight = '+{}'.format(modweight)
-        else:
-            modweight = str(modweight)
+        modweight = format_mod_weight(mod.attrib['monoisotopicMassDelta'])
         location = int(mod.attrib['location'])
         try:
             mods[location] += modweight
@@ -57,6 +77,15 @@ def get_mzid_peptidedata(peptide, xmlns):
     return pep_id, ''.join(outseq)
 
 
+def format_mod_weight(modweight):
+    """Formats modification mass as in MSGF+ TSV peptide sequences"""
+    modweight = round(float(modweight), 3)
+    if modweight > 0:
+        return '+{}'.format(modweight)
+    else:
+        return str(modweight)
+
+
 def generate_mzid_spec_id_items(mzidfile, namespace, xmlns, specfn_idmap):
     specid_tag = '{0}SpectrumIdentificationItem'.format(xmlns)
     for specresult in mzid_spec_result_generator(mzidfile, namespace):
@@ -70,24 +99,16 @@ def generate_mzid_spec_id_items(mzidfile, namespace, xmlns, specfn_idmap):
 
 def mzid_specdata_generator(mzidfile, namespace):
     return basereader.generate_tags_multiple_files(
-        [mzidfile],
-        'SpectraData',
-        ['cvList',
-         'AnalysisSoftwareList',
-         'SequenceCollection',
-         'AnalysisProtocolCollection',
-         'AnalysisCollection',
-         ],
-        namespace)
+        [mzidfile], 'SpectraData', SPECDATA_IGNORE_TAGS, namespace)
 
 
 def get_mzid_specfile_ids(mzidfn, namespace):
     """Returns mzid spectra data filenames and their IDs used in the
     mzIdentML file as a dict. Keys == IDs, values == fns"""
-    sid_fn = {}
-    for specdata in mzid_specdata_generator(mzidfn, namespace):
-        sid_fn[specdata.attrib['id']] = specdata.attrib['name']
-    return sid_fn
+    return dict(basereader.generate_xmltag_fields(
+        mzidfn, 'SpectraData', SPECDATA_IGNORE_TAGS,
+        lambda specdata: (specdata.attrib['id'], specdata.attrib['name']),
+        namespace))
 
 
 def get_specresult_mzml_id(specresult):
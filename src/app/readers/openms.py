@@ -1,5 +1,10 @@
 import os
+from math import nan
+
+import numpy as np
+
 from app.readers import xml as basereader
+from app.readers import xmlformatting as formatting
 
 
 def specfn_quant_generator(specfiles, quantfiles, tag, ignore_tags):
@@ -9,13 +14,6 @@ def specfn_quant_generator(specfiles, quantfiles, tag, ignore_tags):
             yield os.path.basename(specfn), quant_el
 
 
-def mzmlfn_cons_el_generator(specfiles, consfiles):
-    """Returns generation of tuples of spectra file and
-    consensusXML quant elements"""
-    return specfn_quant_generator(specfiles, consfiles, 'consensusElement',
-                                  [])
-
-
 def mzmlfn_feature_generator(specfiles, featfiles):
     """Returns tuple of spectrafile and features of OpenMS
     feature XML format"""
@@ -23,9 +21,30 @@ def mzmlfn_feature_generator(specfiles, featfiles):
                                   ['featureList'])
 
 
-def get_consxml_rt(cons_el):
-    """Returns consensusXML in seconds"""
-    return cons_el.find('centroid').attrib['rt']
+def get_consensus_quants(consfile, channels):
+    """Returns retention times (seconds) of the consensus elements in a
+    consensusXML file, and an array with their reporter intensities in a
+    column per passed channel (map id). Missing reporters are NaN.
+    Only centroid/element tags are parsed, their attributes read in one pass.
+    """
+    chan_ix = {channel: ix for ix, channel in enumerate(channels)}
+    rts, quants = [], []
+    current = None
+    for ac, el in basereader.iterparse_tags(consfile, ['centroid', 'element',
+                                                       'consensusElement']):
+        if el.tag == 'element':
+            if current is not None:
+                current[chan_ix[el.attrib['map']]] = float(el.attrib['it'])
+        elif el.tag == 'centroid':
+            if el.getparent().tag == 'consensusElement':
+                rts.append(float(el.attrib['rt']))
+                current = [nan] * len(channels)
+                quants.append(current)
+        else:
+            current = None
+            formatting.clear_el(el)
+    return (np.array(rts, dtype=float),
+            np.array(quants, dtype=float).reshape(len(rts), len(channels)))
 
 
 def get_feature_info(feature):
@@ -1,11 +1,13 @@
-from lxml import etree
+import numpy as np
+
 from app.readers import xml as basereader
+from app.readers import xmlformatting as formatting
 
 
 def get_percolator_static_xml(fn, ns):
     root = basereader.get_root_el(fn)
-    process = etree.iterparse(fn, tag='{%s}process_info' % ns['xmlns'],
-                              events=('start',))
+    process = basereader.iterparse_tags(fn, ['process_info'], ns,
+                                        events=('start',))
     root.append(next(process)[1])
     return root
 
@@ -43,6 +45,46 @@ def generate_peptides(fn, ns):
     return basereader.generate_xmltags(fn, 'peptide', ['psm', 'protein'], ns)
 
 
+def generate_psms_peptides(fn, ns):
+    """Single pass over a percolator XML, yields ('psm', element) and
+    ('peptide', element) in file order, i.e. all PSMs before peptides"""
+    return basereader.generate_xmltags_multiple(fn, ['psm', 'peptide'],
+                                                ['protein'], ns)
+
+
+def get_psm_peptide_scores(fn, ns):
+    """Single streaming pass over a percolator XML, collecting PSM IDs, svm
+    scores and decoy status of PSMs, and svm scores, decoy status and PSM IDs
+    of peptides. Returns two dicts of lists/arrays: psms, peptides"""
+    xmlns = '{%s}' % ns['xmlns']
+    tags = {'{}{}'.format(xmlns, x): x for x in ['psm', 'peptide', 'protein',
+                                                  'svm_score', 'psm_id']}
+    psms = {'ids': [], 'svm': [], 'decoy': []}
+    peptides = {'svm': [], 'decoy': [], 'psm_ids': []}
+    score, psm_ids = None, []
+    for ac, el in basereader.iterparse_tags(fn, list(tags.values()), ns):
+        tag = tags[el.tag]
+        if tag == 'svm_score':
+            score = float(el.text)
+        elif tag == 'psm_id':
+            psm_ids.append(el.text)
+        elif tag == 'psm':
+            psms['ids'].append(el.attrib['{}psm_id'.format(xmlns)])
+            psms['svm'].append(score)
+            psms['decoy'].append(el.attrib['{}decoy'.format(xmlns)] == 'true')
+        elif tag == 'peptide':
+            peptides['svm'].append(score)
+            peptides['decoy'].append(el.attrib['{}decoy'.format(xmlns)] == 'true')
+            peptides['psm_ids'].append(psm_ids)
+            psm_ids = []
+        if tag in ['psm', 'peptide', 'protein']:
+            formatting.clear_el(el)
+    for feats in [psms, peptides]:
+        feats['svm'] = np.array(feats['svm'], dtype=float)
+        feats['decoy'] = np.array(feats['decoy'], dtype=bool)
+    return psms, peptides
+
+
 def get_peptide_seq(peptide, ns):
     return peptide.attrib['{%s}peptide_id' % ns['xmlns']]
 
@@ -1,40 +1,34 @@
 import os
 from app.readers import xml as basereader
-from app.readers import xmlformatting as formatting
 
 
 def mzmlfn_ms2_spectra_generator(mzmlfiles):
-    for fn, spec, ns in mzmlfn_spectra_generator(mzmlfiles):
-        specparams = get_all_cvparams(spec, ns)
-        mslvl = fetch_cvparam_value_by_name(specparams, 'ms level')
-        if mslvl != '2':
-            continue
-        specscanid = spec.attrib['id']
-        rt, iit, ionmob  = fetch_cvparams_values_from_subel(spec, 'scan', [
-            'scan start time', 
-            'ion injection time', 
-            'inverse reduced ion mobility'], ns)
-        mz, charge = fetch_cvparams_values_from_subel(spec, 'selectedIon', [
-            'selected ion m/z',
-            'charge state'], ns)
-        yield fn, {'specscanid': specscanid, 'ionmob': ionmob, 'rt': rt, 'iit': iit, 
-                'mz': mz, 'charge': charge}
-        formatting.clear_el(spec)
-        # FIXME generator clears since 2.14 so this may be removed
-        # or we revert since it broke at least one external script 
-
-
-def mzmlfn_spectra_generator(mzmlfiles):
     for fn in mzmlfiles:
         ns = basereader.get_namespace(fn)
-        spectra = basereader.generate_xmltags(
-            fn,
-            'spectrum',
-            ['offset',
-             ],
-            ns)
-        for spectrum in spectra:
-            yield os.path.basename(fn), spectrum, ns
+        basefn = os.path.basename(fn)
+        for spec in basereader.generate_xmltag_fields(
+                fn, 'spectrum', ['offset'],
+                lambda spec: get_ms2_spectrum_fields(spec, ns), ns):
+            if spec is not None:
+                yield basefn, spec
+
+
+def get_ms2_spectrum_fields(spec, ns):
+    """Returns a dict with spectrum information if spectrum is MS2, else None"""
+    specparams = get_all_cvparams(spec, ns)
+    mslvl = fetch_cvparam_value_by_name(specparams, 'ms level')
+    if mslvl != '2':
+        return None
+    specscanid = spec.attrib['id']
+    rt, iit, ionmob  = fetch_cvparams_values_from_subel(spec, 'scan', [
+        'scan start time', 
+        'ion injection time', 
+        'inverse reduced ion mobility'], ns)
+    mz, charge = fetch_cvparams_values_from_subel(spec, 'selectedIon', [
+        'selected ion m/z',
+        'charge state'], ns)
+    return {'specscanid': specscanid, 'ionmob': ionmob, 'rt': rt, 'iit': iit, 
+            'mz': mz, 'charge': charge}
 
 
 def fetch_cvparams_values_from_subel(base, subelname, paramnames, ns):
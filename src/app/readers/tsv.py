@@ -1,9 +1,14 @@
 import re
 import os
 import itertools
+
+import numpy as np
+
 from app.dataformats import mzidtsv as mzidtsvdata
 from app.dataformats import prottable as prottabledata
 
+TSV_ARRAY_CHUNK = 100000
+
 
 def get_tsv_header(tsvfn):
     with open(tsvfn) as fp:
@@ -25,18 +30,28 @@ def generate_tsv_pep_protein_quants(fns):
             yield os.path.basename(fn), header, pquant
 
 
-def generate_ms1_feats(fn):
-    """Generates features from a Kronik output file"""
-    header = get_tsv_header(fn)
-    return generate_split_tsv_lines(fn, header)
-
-
-def mzmlfn_tsvfeature_generator(mzmlfns, ms1fns):
-    """Generates tuples of spectra filename and corresponding output
-    features from dinosaur/kronik"""
-    for mzmlfn, ms1fn in zip(mzmlfns, ms1fns):
-        for quant_el in generate_ms1_feats(ms1fn):
-            yield os.path.basename(mzmlfn), quant_el
+def generate_tsv_column_arrays(fn, columns, chunksize=TSV_ARRAY_CHUNK):
+    """Generates chunks of lines from a TSV file as dicts of float arrays,
+    one per passed column name. Only these columns are parsed."""
+    usecols = [get_tsv_header(fn).index(col) for col in columns]
+    with open(fn) as fp:
+        next(fp)  # skip header
+        while True:
+            lines = list(itertools.islice(fp, chunksize))
+            if not lines:
+                break
+            values = np.loadtxt(lines, delimiter='\t', usecols=usecols,
+                                dtype=float, ndmin=2)
+            yield {col: values[:, ix] for ix, col in enumerate(columns)}
+
+
+def get_tsv_column_arrays(fn, columns):
+    """Returns the passed columns of a TSV file as float arrays in a dict"""
+    chunks = list(generate_tsv_column_arrays(fn, columns))
+    if not chunks:
+        return {col: np.array([], dtype=float) for col in columns}
+    return {col: np.concatenate([chunk[col] for chunk in chunks])
+            for col in columns}
 
 
 def generate_split_tsv_lines(fn, header):
@@ -49,27 +49,50 @@ def generate_tags_multiple_files_strings(input_files, ns, tag, ignore_tags):
         yield formatting.string_and_clear(el, ns)
 
 
+def iterparse_tags(fn, tags, ns=None, **kwargs):
+    """Tag filtered iterparse, lxml only creates Python elements for events
+    of elements with these tags. Also parses files with very large text
+    nodes, such as binary data arrays in mzML"""
+    xmlns = create_namespace(ns)
+    return etree.iterparse(fn, tag=['{0}{1}'.format(xmlns, x) for x in tags],
+                           huge_tree=True, **kwargs)
+
+
 def generate_xmltags(fn, returntag, ignore_tags, ns=None):
     """
     Base generator for percolator xml psm, peptide, protein output,
     as well as for mzML, mzIdentML.
     ignore_tags are the ones that are cleared when met by parser
     """
-    xmlns = create_namespace(ns)
-    ns_ignore = ['{0}{1}'.format(xmlns, x) for x in ignore_tags]
-    for ac, el in etree.iterparse(fn):
-        if el.tag == '{0}{1}'.format(xmlns, returntag):
+    ns_returntag = '{0}{1}'.format(create_namespace(ns), returntag)
+    for ac, el in iterparse_tags(fn, [returntag] + ignore_tags, ns):
+        if el.tag == ns_returntag:
             yield el
-            formatting.clear_el(el)
-        elif el.tag in ns_ignore:
-            formatting.clear_el(el)
+        formatting.clear_el(el)
 
 
-def get_element(fn, tag, ns=None):
+def generate_xmltags_multiple(fn, returntags, ignore_tags, ns=None):
+    """Like generate_xmltags, but for multiple return tags in a single pass,
+    yields (tag, element), with tag without namespace"""
     xmlns = create_namespace(ns)
-    for ac, el in etree.iterparse(fn):
-        if el.tag == '{0}{1}'.format(xmlns, tag):
-            return el
+    tags = {'{0}{1}'.format(xmlns, x): x for x in returntags}
+    for ac, el in iterparse_tags(fn, returntags + ignore_tags, ns):
+        tag = tags.get(el.tag)
+        if tag is not None:
+            yield tag, el
+        formatting.clear_el(el)
+
+
+def generate_xmltag_fields(fn, returntag, ignore_tags, get_fields, ns=None):
+    """Like generate_xmltags, but yields get_fields(element) for when only
+    some fields of elements are needed, elements are cleared after that"""
+    for el in generate_xmltags(fn, returntag, ignore_tags, ns):
+        yield get_fields(el)
+
+
+def get_element(fn, tag, ns=None):
+    for ac, el in iterparse_tags(fn, [tag], ns):
+        return el
 
 
 def create_namespace(ns):
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from lxml import etree
 
 def string_and_clear(el, ns):
@@ -6,14 +8,28 @@ def string_and_clear(el, ns):
     return str_el
 
 def stringify_strip_namespace_declaration(el, ns):
-    strxml = etree.tostring(el, encoding='utf-8').decode('utf-8')
-    strxml = strxml.replace('xmlns="{0}" '.format(ns['xmlns']), '')
-    strxml = strxml.replace('xmlns:p="{0}" '.format(ns['xmlns:p']), '')
-    strxml = strxml.replace('xmlns:xsi="{0}" '.format(ns['xmlns:xsi']), '')
-    return strxml
+    return serialize_strip_namespace_declaration(el, ns).decode('utf-8')
+
+def serialize_strip_namespace_declaration(el, ns):
+    """Returns element as UTF-8 bytes, without the namespace declarations
+    lxml puts in its opening tag when serializing it out of its tree"""
+    xml = etree.tostring(el, encoding='utf-8')
+    tagend = xml.index(b'>')
+    opening = xml[:tagend]
+    for declaration in get_namespace_declarations(ns['xmlns'], ns['xmlns:p'],
+                                                  ns['xmlns:xsi']):
+        opening = opening.replace(declaration, b'')
+    return opening + xml[tagend:]
+
+@lru_cache()
+def get_namespace_declarations(xmlns, xmlns_p, xmlns_xsi):
+    return ['{0}="{1}" '.format(prefix, uri).encode('utf-8') for prefix, uri in
+            [('xmlns', xmlns), ('xmlns:p', xmlns_p), ('xmlns:xsi', xmlns_xsi)]]
 
 def clear_el(el):
+    """Clears element and removes its already parsed previous siblings"""
     el.clear()
-    while el.getprevious() is not None:
-        del(el.getparent()[0])
+    parent = el.getparent()
+    if parent is not None:
+        del(parent[:parent.index(el)])
 
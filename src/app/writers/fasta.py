@@ -0,0 +1,27 @@
+from itertools import islice
+
+# Biopython line length, so output does not change
+FASTA_LINE_LENGTH = 60
+# Amount of records to format and write at once
+FASTA_WRITE_CHUNK = 10000
+
+
+def write_fasta(records, outfn):
+    """Writes (header, sequence) records to a FASTA file, with sequences
+    wrapped in lines of FASTA_LINE_LENGTH. Records are formatted and written
+    in chunks instead of one at a time"""
+    records = iter(records)
+    with open(outfn, 'w') as fp:
+        chunk = list(islice(records, FASTA_WRITE_CHUNK))
+        while chunk:
+            fp.write(''.join(['>{}\n{}'.format(header, wrap_sequence(seq))
+                              for header, seq in chunk]))
+            chunk = list(islice(records, FASTA_WRITE_CHUNK))
+
+
+def wrap_sequence(seq):
+    if len(seq) <= FASTA_LINE_LENGTH:
+        # Most sequences, e.g. peptides
+        return '{}\n'.format(seq) if seq else ''
+    return ''.join(['{}\n'.format(seq[i:i + FASTA_LINE_LENGTH])
+                    for i in range(0, len(seq), FASTA_LINE_LENGTH)])
@@ -1,42 +1,82 @@
 from lxml import etree
 
+# PSMs and peptides are written as many small byte strings
+XML_WRITE_BUFFER = 2 ** 20
 
-def write_percolator_xml(staticxml, feats, fn):
-    """Given the static percolator xml root and process info nodes, and all
-    psms and peptides as iterators in a dict {'peptide': pep_iterator, 'psm':
-    psm_iterator}, this generates percolator out data into a file."""
 
-    # First get xml until psms opening element is found.
+def get_percolator_xml_opening(staticxml):
+    """Returns xml bytes of the static percolator xml root and process info
+    nodes until the psms opening element"""
+    staticxml = etree.fromstring(etree.tostring(staticxml))
     etree.SubElement(staticxml, 'psms').text = '***psms***'
     root = etree.tostring(staticxml, pretty_print=True,
                           xml_declaration=True, encoding='UTF-8')
-    root = root.decode('utf-8')
-    root = root[:root.find('***psms***')]
+    return root[:root.find(b'***psms***')]
 
-    # Write opening xml
-    with open(fn, 'w') as fp:
+
+def write_percolator_xml(staticxml, feats, fn):
+    """Given the static percolator xml root and process info nodes, and all
+    psms and peptides as iterators of xml bytes in a dict {'peptide':
+    pep_iterator, 'psm': psm_iterator}, this generates percolator out data
+    into a file."""
+
+    # First get xml until psms opening element is found.
+    root = get_percolator_xml_opening(staticxml)
+
+    with open(fn, 'wb', buffering=XML_WRITE_BUFFER) as fp:
+        # Write opening xml
         fp.write(root)
-        fp.write('\n')
+        fp.write(b'\n')
 
-    # Then write features
-    with open(fn, 'a') as fp:
+        # Then write features
         psmcount = 0
         for psm in feats['psm']:
             psmcount += 1
             fp.write(psm)
-            fp.write('\n')
-        fp.write('</psms><peptides>\n')
+            fp.write(b'\n')
+        fp.write(b'</psms><peptides>\n')
 
         peptidecount = 0
         for pep in feats['peptide']:
             peptidecount += 1
             fp.write(pep)
-            fp.write('\n')
-        fp.write('</peptides></percolator_output>')
+            fp.write(b'\n')
+        fp.write(b'</peptides></percolator_output>')
     print('Wrote {0} psms, {1} peptides to file {2}'.format(psmcount,
                                                             peptidecount, fn))
 
 
+def write_split_percolator_xml(staticxml, feats, fns):
+    """Like write_percolator_xml, but for multiple output files, and with
+    feats being a single iterator of (feature type, xml bytes, indices of
+    output files to write to) for all psms followed by all peptides"""
+    root = get_percolator_xml_opening(staticxml)
+    counts = [{'psm': 0, 'peptide': 0} for fn in fns]
+    fps = [open(fn, 'wb', buffering=XML_WRITE_BUFFER) for fn in fns]
+    try:
+        for fp in fps:
+            fp.write(root)
+            fp.write(b'\n')
+        in_psms = True
+        for feattype, feat, outputs in feats:
+            if in_psms and feattype == 'peptide':
+                [fp.write(b'</psms><peptides>\n') for fp in fps]
+                in_psms = False
+            for ix in outputs:
+                fps[ix].write(feat)
+                fps[ix].write(b'\n')
+                counts[ix][feattype] += 1
+        for fp in fps:
+            if in_psms:
+                fp.write(b'</psms><peptides>\n')
+            fp.write(b'</peptides></percolator_output>')
+    finally:
+        [fp.close() for fp in fps]
+    for fn, count in zip(fns, counts):
+        print('Wrote {0} psms, {1} peptides to file {2}'.format(count['psm'],
+                                                                count['peptide'], fn))
+
+
 def write_qvality_input(scores, fn):
     with open(fn, 'w') as fp:
         for score in scores:
@@ -4,6 +4,7 @@ import os
 import shutil
 import sqlite3
 import re
+from itertools import product
 from lxml import etree
 from tempfile import mkdtemp
 
@@ -175,6 +176,10 @@ class BaseTestPycolator(BaseTest):
     def get_subelements(self, elements, subel, ns):
         return [element.find('{%s}%s' % (ns, subel)) for element in elements]
 
+    def deamidate(self, sequence):
+        aa_possible = [(aa,) if aa != 'D' else ('D', 'N') for aa in sequence]
+        return list(''.join(aa) for aa in product(*aa_possible))
+
     def strip_modifications(self, pep):
         return re.sub('\[UNIMOD:\d*\]', '', pep)
 
@@ -247,12 +252,12 @@ class MSLookupTest(BaseTest):
         if self.base_db_fn is not None:
             self.copy_db_to_workdir(self.base_db_fn)
 
-    def run_command(self, options=None):
+    def run_command(self, options=None, return_error=False):
         if options is None:
             options = []
         if self.base_db_fn is not None:
             options.extend(['--dbfile', self.resultfn])
-        super().run_command(options)
+        return super().run_command(options, return_error)
 
 
 class ProttableTest(BaseTest):
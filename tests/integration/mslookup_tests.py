@@ -1,6 +1,7 @@
 from tests.integration import basetests
 
 import os
+import sys
 import sqlite3
 import json
 from Bio import SeqIO
@@ -15,6 +16,16 @@ class SearchspaceLookup(basetests.BaseTest):
         super().setUp()
         self.infile = os.path.join(self.basefixdir, self.infilename)
 
+    def get_repeated_fasta(self, times=3):
+        """Returns a FASTA with the ENSEMBL fixture repeated, so its proteins
+        span multiple digestion chunks and recur in later chunks"""
+        fastafn = os.path.join(self.workdir, 'repeated.fasta')
+        with open(os.path.join(self.basefixdir, 'ens99_small.fasta')) as fp:
+            proteins = fp.read()
+        with open(fastafn, 'w') as fp:
+            fp.write(proteins * times)
+        return fastafn
+
 
 class TestTrypsinize(SearchspaceLookup):
     suffix = '_tryp.fa'
@@ -49,6 +60,14 @@ class TestTrypsinize(SearchspaceLookup):
     def test_miss_cleavage(self):
         self.run_case(False, False, 1)
 
+    def test_processes(self):
+        self.infile = self.get_repeated_fasta()
+        serialfn = os.path.join(self.workdir, 'serial_tryp.fa')
+        self.run_command(['-o', serialfn, '--miscleav', '1'])
+        self.run_command(['-o', self.resultfn, '--miscleav', '1', '--processes', '2'])
+        with open(serialfn) as fp, open(self.resultfn) as resfp:
+            self.assertEqual(resfp.read(), fp.read())
+
 
 class TestDecoyFa(SearchspaceLookup):
     command = 'makedecoy'
@@ -97,6 +116,20 @@ class TestDecoyFa(SearchspaceLookup):
         self.run_without_db(['--scramble', 'tryp_rev'])
         self.check_seqs('decoy_tryprev_targetcheck_twoproteins.fasta', targetscrambling=True)
 
+    def test_tryprev_inmemory(self):
+        self.run_without_db(['--scramble', 'tryp_rev', '--in-memory'])
+        self.check_seqs('decoy_tryprev_targetcheck_twoproteins.fasta', targetscrambling=True)
+
+    def test_tryprev_seed_processes(self):
+        self.run_without_db(['--scramble', 'tryp_rev', '--in-memory', '--seed', '1',
+                             '--processes', '2'])
+        self.check_seqs('decoy_tryprev_targetcheck_twoproteins.fasta', targetscrambling=True)
+        with open(self.resultfn) as fp:
+            parallel_decoys = fp.read()
+        self.run_without_db(['--scramble', 'tryp_rev', '--in-memory', '--seed', '1'])
+        with open(self.resultfn) as fp:
+            self.assertEqual(fp.read(), parallel_decoys)
+
     def test_tryprev_yesdb_minlen(self):
         self.run_without_db(['--scramble', 'tryp_rev', '--minlen', '5'])
         self.check_seqs('decoy_tryprev_minlen_twoproteins.fasta', targetscrambling=True)
@@ -162,6 +195,10 @@ class TestTrypticLookup(SearchspaceLookup):
         self.run_command(options)
         self.assertTrue(self.all_seqs_in_db(self.resultfn,
                                             sequences, seqtype))
+        db = sqlite3.connect(self.resultfn)
+        self.assertIn(('deamidated_index',), db.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'").fetchall())
+        db.close()
 
     def run_without_db(self, options=None, seqtype=None):
         self.resultfn = os.path.join(self.workdir,
@@ -194,19 +231,42 @@ class TestTrypticLookup(SearchspaceLookup):
     def test_noflags_yes_db(self):
         self.run_with_existing_db()
 
+    def test_processes(self):
+        self.infile = self.get_repeated_fasta()
+        sql = 'SELECT seqs FROM known_searchspace ORDER BY rowid'
+        for options in [[], ['--insourcefrag']]:
+            serialfn = os.path.join(self.workdir, 'serial.sqlite')
+            parallelfn = os.path.join(self.workdir, 'parallel.sqlite')
+            self.resultfn = serialfn
+            self.run_command(options)
+            self.resultfn = parallelfn
+            self.run_command(['--processes', '2', *options])
+            serial_seqs = self.get_values_from_db(serialfn, sql).fetchall()
+            self.assertGreater(len(serial_seqs), 0)
+            self.assertEqual(self.get_values_from_db(parallelfn, sql).fetchall(),
+                             serial_seqs)
+            os.remove(serialfn)
+            os.remove(parallelfn)
+
 
 class TestWholeProteinSeqLookup(SearchspaceLookup):
     command = 'storeseq'
 
     def all_seqs_in_db(self, dbfn, sequences, seqtype):
         db = sqlite3.connect(dbfn)
-        seqs_in_db = set()
-        sql = ('SELECT EXISTS(SELECT seq FROM protein_peptides WHERE '
-               'seq=? LIMIT 1)')
-        for seq in sequences:
-            seqs_in_db.add(db.execute(sql, (seq,)).fetchone()[0] == 1)
+        chunks = db.execute('SELECT sequence, suffix_array FROM proteome_index '
+                            'ORDER BY chunk_id')
+        proteome, suffixes = b'', b''
+        for seqchunk, suffixchunk in chunks:
+            proteome += seqchunk
+            suffixes += suffixchunk
         db.close()
-        return seqs_in_db == set([True])
+        suffixes = [int.from_bytes(suffixes[i:i+4], sys.byteorder)
+                    for i in range(0, len(suffixes), 4)]
+        self.assertEqual(sorted(range(len(proteome)), key=lambda x: proteome[x:]),
+                         suffixes)
+        proteome = proteome.decode()
+        return all(seq in proteome for seq in sequences)
 
     def query_db_assert(self, options):
         with open(os.path.join(self.basefixdir, 'allpeptides_proteins.json')) as fp:
@@ -383,6 +443,46 @@ class TestSpecQuantLookup(basetests.MSLookupTest):
         self.check_quantmap()
         self.check_quantification()
 
+    def write_shifted_consensusxml(self, outfn, shift, amount=None):
+        """Writes the consensusXML with the retention time (seconds) of the
+        first amount (default all) consensus elements shifted"""
+        consxml = etree.parse(self.isoinfile)
+        for centroid in consxml.findall('.//consensusElement/centroid')[:amount]:
+            centroid.attrib['rt'] = str(float(centroid.attrib['rt']) + shift)
+        consxml.write(outfn)
+
+    def get_isobaric_quants(self):
+        sql = ('SELECT spectra_id, channel_id, intensity FROM isobaric_quant '
+               'ORDER BY spectra_id, channel_id, intensity')
+        return self.get_values_from_db(self.resultfn, sql).fetchall()
+
+    def test_isoquant_rt_tolerance(self):
+        self.run_command(['--isobaric', self.isoinfile, '--spectra', self.fakespfn])
+        expected_quants = self.get_isobaric_quants()
+        # Shift within the tolerance of 0.00001 minutes
+        shiftedfn = os.path.join(self.workdir, 'shifted.consXML')
+        self.write_shifted_consensusxml(shiftedfn, 0.0003)
+        self.resultfn = os.path.join(self.workdir, 'shifted.sqlite')
+        self.copy_db_to_workdir(self.base_db_fn, self.resultfn)
+        self.run_command(['--isobaric', shiftedfn, '--spectra', self.fakespfn])
+        self.assertEqual(self.get_isobaric_quants(), expected_quants)
+
+    def test_isoquant_rt_out_of_tolerance(self):
+        shiftedfn = os.path.join(self.workdir, 'shifted.consXML')
+        self.write_shifted_consensusxml(shiftedfn, 0.01, amount=1)
+        res = self.run_command(['--isobaric', shiftedfn, '--spectra', self.fakespfn],
+                               return_error=True)
+        self.assertNotEqual(res.returncode, 0)
+        self.assertIn('RuntimeError: Could not find a spectrum in the lookup',
+                      res.stderr)
+
+    def test_isoquant_multiproc(self):
+        options = ['--isobaric', self.isoinfile, self.isoinfile, '--spectra',
+                self.fakespfn, self.fakespfn2, '--processes', '2']
+        self.run_command(options)
+        self.check_quantmap()
+        self.check_quantification()
+
     def test_dinosaur(self):
         options = ['--dinosaur', self.dinofile, self.dinofile, '--rttol', '5', 
                 '--mztol', '20', '--mztoltype', 'ppm', '--spectra', self.fakespfn, 
@@ -390,6 +490,13 @@ class TestSpecQuantLookup(basetests.MSLookupTest):
         self.run_command(options)
         self.check_ms1_feats_stored(self.dinofile, 'dino', 'sum')
 
+    def test_dinosaur_multiproc(self):
+        options = ['--dinosaur', self.dinofile, self.dinofile, '--rttol', '5',
+                '--mztol', '20', '--mztoltype', 'ppm', '--spectra', self.fakespfn,
+                self.fakespfn2, '--processes', '2']
+        self.run_command(options)
+        self.check_ms1_feats_stored(self.dinofile, 'dino', 'sum')
+
     def test_dinosaur_apex(self):
         options = ['--dinosaur', self.dinofile, self.dinofile, '--rttol', '5',
                 '--mztol', '20', '--apex', '--mztoltype', 'ppm', '--spectra', self.fakespfn,
@@ -221,6 +221,29 @@ class TestGenenameTable(basetests.ProttableTest):
         expectedfn = os.path.join(self.fixdir, 'genenames.txt')
         self.check_lines(expectedfn, self.resultfn)
 
+    def concat_fasta(self, outfn, fastafns):
+        outfn = os.path.join(self.workdir, outfn)
+        with open(outfn, 'w') as wfp:
+            for fn in fastafns:
+                with open(fn) as fp:
+                    wfp.write(fp.read())
+        return outfn
+
+    def test_fastadelim_no_genefield(self):
+        # Contaminants have pipe delimited headers without ENSEMBL/Uniprot
+        # annotation, they get no gene name when not passing --genefield
+        tfasta = self.concat_fasta('target.fasta', [
+            os.path.join(self.basefixdir, 'ens99_small.fasta'),
+            os.path.join(self.fixdir, 'contaminants.fasta')])
+        dfasta = self.concat_fasta('decoy.fasta', [
+            os.path.join(self.fixdir, 'protrev_ens99_small.fasta'),
+            os.path.join(self.fixdir, 'decoy_contaminants.fasta')])
+        self.specialoptions = ['--targetfasta', tfasta, '--decoyfasta', dfasta,
+                               '--fastadelim', 'pipe']
+        self.dotest_proteintable('^q-value', 'Gene Name', 'Gene Name')
+        expectedfn = os.path.join(self.fixdir, 'genenames.txt')
+        self.check_lines(expectedfn, self.resultfn)
+
 
 class TestENSGTable(basetests.ProttableTest):
     command = 'ensg'
@@ -1,6 +1,7 @@
 import os
+import shutil
 import sqlite3
-from itertools import product
+import subprocess
 
 from tests.integration.basetests import BaseTestPycolator
 
@@ -62,17 +63,37 @@ class TestFilterKnown(BaseTestPycolator):
 
     def test_deamidate(self):
         self.dbpath = os.path.join(self.basefixdir, self.dbfn)
-        self.assert_seqs_correct(['--deamidate'], 'deamidate')
+        res = self.assert_seqs_correct(['--deamidate'], 'deamidate')
+        # Fixture lookup was created before storeseq indexed deamidated peptides
+        self.assertIn('WARNING: lookup has no index on deamidated peptides',
+                      res.stdout)
 
-    def deamidate(self, sequence):
-        aa_possible = [(aa,) if aa != 'D' else ('D', 'N') for aa in sequence]
-        return list(''.join(aa) for aa in product(*aa_possible))
+    def test_deamidate_indexed(self):
+        self.dbpath = os.path.join(self.workdir, self.dbfn)
+        shutil.copy(os.path.join(self.basefixdir, self.dbfn), self.dbpath)
+        db = sqlite3.connect(self.dbpath)
+        db.execute("CREATE INDEX deamidated_index ON known_searchspace("
+                   "REPLACE(seqs, 'D', 'N'))")
+        db.commit()
+        db.close()
+        res = self.assert_seqs_correct(['--deamidate'], 'deamidate')
+        self.assertNotIn('WARNING', res.stdout)
+
+    def test_in_memory(self):
+        self.dbpath = os.path.join(self.basefixdir, self.dbfn)
+        self.assert_seqs_correct(['--in-memory'])
+
+    def test_ntermwildcards_in_memory(self):
+        max_falloff = 12
+        self.dbpath = os.path.join(self.basefixdir, self.reversed_dbfn)
+        self.assert_seqs_correct(['--insourcefrag', str(max_falloff), '--in-memory'],
+                                 'ntermfalloff', max_falloff)
 
     def assert_seqs_correct(self, flags=[], seqtype=None, max_falloff=False):
         """Does the actual testing"""
         options = ['--dbfile', self.dbpath]
         options.extend(flags)
-        self.run_command(options)
+        res = self.run_command(options)
         result = self.get_psm_pep_ids_from_file(self.resultfn)
         origin = self.get_psm_pep_ids_from_file(self.infile[0])
         for feattype in ['peptide_ids', 'psm_seqs']:
@@ -91,3 +112,71 @@ class TestFilterKnown(BaseTestPycolator):
                         break
                     else:
                         self.assertIn(oriseq, result_seqs)
+        return res
+
+
+class TestFilterFullProtein(BaseTestPycolator):
+    command = 'filterperco'
+    fastafn = 'perco_fullproteins.fasta'
+
+    def setUp(self):
+        super().setUp()
+        self.fasta = os.path.join(self.fixdir, self.fastafn)
+        self.dbpath = os.path.join(self.workdir, 'fullprotein.sqlite')
+        subprocess.run([self.executable, 'storeseq', '-i', self.fasta,
+                        '--fullprotein', '-o', self.dbpath], check=True)
+        with open(self.fasta) as fp:
+            self.proteins = [line.strip().replace('L', 'I') for line in fp
+                             if not line.startswith('>')]
+
+    def test_noflags(self):
+        self.assert_seqs_correct([], 5)
+
+    def test_enforce_tryptic(self):
+        # A peptide preceded by a non-tryptic residue is kept
+        self.assert_seqs_correct(['--enforce-tryptic'], 4, enforce_tryp=True)
+
+    def test_deamidate(self):
+        # A peptide matching a protein only with D->N is filtered
+        self.assert_seqs_correct(['--deamidate'], 6, deamidate=True)
+
+    def test_minlen(self):
+        self.assert_seqs_correct(['--minlen', '8'], 3, minlen=8)
+
+    def test_all_flags(self):
+        self.assert_seqs_correct(['--enforce-tryptic', '--deamidate', '--minlen', '8'],
+                                 3, True, True, 8)
+
+    def seq_matches_protein(self, seq, deamidate, enforce_tryp, minlen):
+        """Reference check whether a peptide should be filtered: it (or a
+        deamidated variant) is in a protein, and at the protein N-terminal or
+        tryptic when enforcing that"""
+        if len(seq) < minlen:
+            return False
+        variants = self.deamidate(seq) if deamidate else [seq]
+        for variant in variants:
+            for protein in self.proteins:
+                pos = protein.find(variant)
+                while pos > -1:
+                    if not enforce_tryp or pos == 0 or (
+                            variant[-1] in 'KR' and protein[pos - 1] in 'KR'):
+                        return True
+                    pos = protein.find(variant, pos + 1)
+        return False
+
+    def assert_seqs_correct(self, flags, amount_filtered, deamidate=False,
+                            enforce_tryp=False, minlen=0):
+        options = ['--dbfile', self.dbpath, '--fullprotein']
+        options.extend(flags)
+        self.run_command(options)
+        result = self.get_psm_pep_ids_from_file(self.resultfn)
+        origin = self.get_psm_pep_ids_from_file(self.infile[0])
+        filtered_peptides = set(origin['peptide_ids']) - set(result['peptide_ids'])
+        self.assertEqual(len(filtered_peptides), amount_filtered)
+        for feattype in ['peptide_ids', 'psm_seqs']:
+            for oriseq in origin[feattype]:
+                seq = self.strip_modifications(oriseq).replace('L', 'I')
+                if self.seq_matches_protein(seq, deamidate, enforce_tryp, minlen):
+                    self.assertNotIn(oriseq, result[feattype])
+                else:
+                    self.assertIn(oriseq, result[feattype])
@@ -1,6 +1,7 @@
 import os
 import re
 import subprocess
+import shutil
 from lxml import etree
 from Bio import SeqIO
 from statistics import median
@@ -40,6 +41,30 @@ class TestPSMTable(MzidWithDB):
         self.check_quanttsv()
         self.check_addgenes()
 
+    def test_fasta_cache(self):
+        fastafn = os.path.join(self.basefixdir, 'ens99_small.fasta')
+        cachedir = os.path.join(self.workdir, 'fastacache')
+        os.makedirs(cachedir)
+        options = ['--dbfile', self.workdb, '--spectracol', '1', '--genes',
+                '--proteingroup', '--fasta', fastafn, '--fastacache', cachedir]
+        self.run_command(options)
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+        with open(self.resultfn) as fp:
+            uncached_psms = fp.read()
+        self.copy_db_to_workdir(self.dbfn, self.workdb)
+        self.run_command(options)
+        self.check_db_fasta(fastafn)
+        with open(self.resultfn) as fp:
+            self.assertEqual(fp.read(), uncached_psms)
+
+    def test_fasta_cache_new_dir(self):
+        fastafn = os.path.join(self.basefixdir, 'ens99_small.fasta')
+        cachedir = os.path.join(self.workdir, 'cache', 'fasta')
+        options = ['--dbfile', self.workdb, '--spectracol', '1', '--genes',
+                '--fasta', fastafn, '--fastacache', cachedir]
+        self.run_command(options)
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+
     def test_ionmobility(self):
         self.infilename = 'few_spec_timstof.tsv'
         options = ['--dbfile', self.workdb, '--spectracol', '1', '--addmiscleav', '--addbioset']
@@ -306,6 +331,63 @@ class TestPercoTSV(basetests.MzidTSVBaseTest):
                     self.assertEqual(field, res[i][1])
                     self.assertEqual(exp[field], res[i][2])
 
+    def test_psms_without_peptide(self):
+        mzidfn = os.path.join(self.fixdir, 'few_spectra.mzid')
+        percofn = os.path.join(self.workdir, 'perco_nopeptides.xml')
+        perco = etree.parse(os.path.join(self.fixdir, 'perco.xml'))
+        for peptides in perco.getroot().findall('{*}peptides'):
+            for peptide in peptides.findall('{*}peptide'):
+                peptides.remove(peptide)
+        perco.write(percofn)
+        options = ['--mzid', mzidfn, '--perco', percofn]
+        self.run_command(options)
+        pepqvals = [x[0][1] for x in self.get_values(['peptide q-value'])]
+        self.assertGreater(len(pepqvals), 0)
+        self.assertEqual(set(pepqvals), {'1'})
+
+    def test_add_tdc_fdr_multiproc(self):
+        mzidfn = os.path.join(self.fixdir, 'few_spectra.mzid')
+        percofn = os.path.join(self.fixdir, 'perco.xml')
+        infile2 = os.path.join(self.workdir, 'few_spectra_2.tsv')
+        shutil.copy(self.infile, infile2)
+        self.infile = [self.infile, infile2]
+        self.resultfn = None
+        options = ['--mzid', mzidfn, mzidfn, '--perco', percofn, '--processes', '2']
+        self.run_command(options)
+        with open(os.path.join(self.fixdir, 'few_spectra.tsv_fdr.tsv')) as fp:
+            expected = fp.read()
+        for fn in ['few_spectra.tsv_fdr.tsv', 'few_spectra_2.tsv_fdr.tsv']:
+            with open(os.path.join(self.workdir, fn)) as fp:
+                self.assertEqual(expected, fp.read())
+
+    def test_add_tdc_fdr_mzid_index(self):
+        # Index is stored next to mzIdentML, do not alter fixture dir
+        mzidfn = os.path.join(self.workdir, 'few_spectra.mzid')
+        shutil.copy(os.path.join(self.fixdir, 'few_spectra.mzid'), mzidfn)
+        percofn = os.path.join(self.fixdir, 'perco.xml')
+        # Reversed PSM table with every third PSM removed
+        with open(self.infile) as fp:
+            header = next(fp)
+            psms = [line for i, line in enumerate(fp) if i % 3]
+        self.infile = os.path.join(self.workdir, 'few_spectra_filt.tsv')
+        self.resultfn = os.path.join(self.workdir, 'few_spectra_filt.tsv_fdr.tsv')
+        with open(self.infile, 'w') as fp:
+            fp.write(header)
+            fp.write(''.join(psms[::-1]))
+        options = ['--mzid', mzidfn, '--perco', percofn, '--index-mzids']
+        self.run_command(options)
+        self.assertTrue(os.path.exists(mzidfn + '.psmindex.sqlite'))
+        with open(os.path.join(self.fixdir, 'few_spectra.tsv_fdr.tsv')) as fp:
+            next(fp)
+            expected = {tuple(line.split('\t')[:9]): line for line in fp}
+        with open(self.resultfn) as fp:
+            next(fp)
+            result = [line for line in fp]
+        self.assertGreater(len(result), 0)
+        expected_psms = [expected[tuple(line.split('\t')[:9])] for line in psms[::-1]
+                         if tuple(line.split('\t')[:9]) in expected]
+        self.assertEqual(expected_psms, result)
+
 
 class TestPercoTSVTIMS(basetests.MzidTSVBaseTest):
     command = 'perco2psm'